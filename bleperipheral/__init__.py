@@ -3,8 +3,11 @@ bleperipheral package
     Copyright (c) 2020 jp-96
 '''
 from bleperipheral.ble_peripheral import BLEPeripheral
-from bleperipheral.ble_advertising import advertising_payload, decode_field, decode_name, decode_services, decode_service_data
+from bleperipheral.ble_events import OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE
+from bleperipheral.ble_advertising import AdvertisingPayload, advertising_payload, decode_field, decode_name, decode_services, decode_service_data
 
 __version__ = '1.1.1'
 
-__all__ = ['BLEPeripheral', 'advertising_payload', 'decode_field', 'decode_name', 'decode_services', 'decode_service_data']
\ No newline at end of file
+# Everything else is imported from its module (bleperipheral.ble_uart,
+# bleperipheral.ble_publish, ...) so that apps only load what they use.
+__all__ = ['BLEPeripheral', 'OVERFLOW_DROP_OLDEST', 'OVERFLOW_COALESCE', 'AdvertisingPayload', 'advertising_payload', 'decode_field', 'decode_name', 'decode_services', 'decode_service_data']
@@ -10,6 +10,7 @@ The MIT License (MIT)
 # Helpers for generating BLE advertising payloads.
 
 import struct
+from array import array
 from bleperipheral.util import bluetooth, const
 
 # Advertising payloads are repeated packets of the following form:
@@ -29,6 +30,9 @@ _ADV_TYPE_UUID128_MORE = const(0x6)
 _ADV_TYPE_SERVICE_DATA = const(0x16)
 _ADV_TYPE_APPEARANCE = const(0x19)
 
+# Legacy advertising and scan response PDUs carry at most 31 bytes each.
+_ADV_MAX_PAYLOAD = const(31)
+
 
 # Generate a payload to be passed to gap_advertise(adv_data=...).
 def advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, service_data=None, appearance=0):
@@ -44,7 +48,7 @@ def advertising_payload(limited_disc=False, br_edr=False, name=None, services=No
     )
 
     if name:
-        _append(_ADV_TYPE_NAME, name)
+        _append(_ADV_TYPE_NAME, name.encode() if isinstance(name, str) else name)
 
     if services:
         for uuid in services:
@@ -65,6 +69,228 @@ def advertising_payload(limited_disc=False, br_edr=False, name=None, services=No
     return payload
 
 
+class AdvertisingPayload:
+    '''
+    Advertising data and scan response laid out in one preallocated buffer.
+
+    Fields are placed in the advertising data while they fit; name, 128-bit
+    UUIDs and service data spill into the scan response, anything else that
+    does not fit raises ValueError. adv and resp are memoryviews into the
+    buffer (resp is None when empty) that can be passed to gap_advertise.
+
+    AdvertisingPayload(adv, resp) wraps payloads computed earlier, e.g. the
+    bytes returned by freeze() and kept in a frozen module.
+    '''
+
+    def __init__(self, adv=None, resp=None, max_size=_ADV_MAX_PAYLOAD):
+        self._max = max_size
+        self._buf = bytearray(2 * max_size)
+        self._mv = memoryview(self._buf)
+        self._len = [0, 0]
+        self._fields = {}
+        for i, payload in ((0, adv), (1, resp)):
+            if payload:
+                n = len(payload)
+                if n > max_size:
+                    raise ValueError("advertising payload too large")
+                self._mv[i * max_size:i * max_size + n] = payload
+                self._len[i] = n
+                self._index(i)
+        self._views()
+
+    @classmethod
+    def create(cls, limited_disc=False, br_edr=False, name=None, services=None, service_data=None, appearance=0, max_size=_ADV_MAX_PAYLOAD):
+        p = cls(max_size=max_size)
+        p.add(_ADV_TYPE_FLAGS, struct.pack("B", (0x01 if limited_disc else 0x02) + (0x00 if br_edr else 0x04)))
+        if services:
+            uuids = ([], [], [])
+            for uuid in services:
+                b = bytes(uuid)
+                uuids[(2, 4, 16).index(len(b))].append(b)
+            if uuids[0]:
+                p.add(_ADV_TYPE_UUID16_COMPLETE, b"".join(uuids[0]))
+            if uuids[1]:
+                p.add(_ADV_TYPE_UUID32_COMPLETE, b"".join(uuids[1]))
+        if appearance:
+            # See org.bluetooth.characteristic.gap.appearance.xml
+            p.add(_ADV_TYPE_APPEARANCE, struct.pack("<H", appearance))
+        if service_data:
+            p.add(_ADV_TYPE_SERVICE_DATA, service_data, True)
+        if name:
+            p.add(_ADV_TYPE_NAME, name.encode() if isinstance(name, str) else name, True)
+        if services and uuids[2]:
+            p.add(_ADV_TYPE_UUID128_COMPLETE, b"".join(uuids[2]), True)
+        return p
+
+    def add(self, adv_type, value, spill=False):
+        size = len(value) + 2
+        for i in ((0, 1) if spill else (0,)):
+            n = self._len[i]
+            if n + size <= self._max:
+                at = i * self._max + n
+                self._buf[at] = size - 1
+                self._buf[at + 1] = adv_type
+                self._mv[at + 2:at + size] = value
+                self._len[i] = n + size
+                if adv_type not in self._fields:
+                    self._fields[adv_type] = (i, n + 2, size - 2)
+                self._views()
+                return
+        raise ValueError("advertising payload too large")
+
+    def field(self, adv_type):
+        '''
+        returns
+        ----------
+            (in_resp:bool, offset:int, length:int) of the first adv_type
+            field's value, or None.
+        '''
+        f = self._fields.get(adv_type)
+        return (f[0] == 1, f[1], f[2]) if f else None
+
+    def freeze(self):
+        return (bytes(self.adv), bytes(self.resp) if self.resp else None)
+
+    def _index(self, i):
+        base = i * self._max
+        j = 0
+        while j + 1 < self._len[i]:
+            n = self._buf[base + j]
+            if n == 0:
+                break
+            adv_type = self._buf[base + j + 1]
+            if adv_type not in self._fields:
+                self._fields[adv_type] = (i, j + 2, n - 1)
+            j += 1 + n
+
+    def _views(self):
+        self.adv = self._mv[0:self._len[0]]
+        self.resp = self._mv[self._max:self._max + self._len[1]] if self._len[1] else None
+
+
+_PARSER_MAX_FIELDS = const(32)
+_UUID_CACHE_SIZE = const(64)
+
+
+class AdvParser:
+    '''
+    Indexes every AD structure of a payload in one pass and hands out
+    memoryview slices of it, so a scan result is walked once however many
+    fields are looked up. Decoded UUIDs are shared through a small cache.
+
+    One parser can be reused with parse(). The slices point into the
+    parsed payload: in an _IRQ_SCAN_RESULT handler that buffer is reused
+    by the stack after the handler returns, so copy what must be kept.
+    '''
+
+    _uuids = {}
+
+    def __init__(self, payload=None):
+        self._types = bytearray(_PARSER_MAX_FIELDS)
+        self._starts = array("H", [0] * _PARSER_MAX_FIELDS)
+        self._lens = bytearray(_PARSER_MAX_FIELDS)
+        self._count = 0
+        self._mv = None
+        self._name = None
+        self._services = None
+        if payload is not None:
+            self.parse(payload)
+
+    def parse(self, payload):
+        mv = memoryview(payload)
+        self._mv = mv
+        self._name = None
+        self._services = None
+        n = len(mv)
+        i = 0
+        count = 0
+        while i + 1 < n and count < _PARSER_MAX_FIELDS:
+            length = mv[i]
+            if length == 0 or i + 1 + length > n:
+                break
+            self._types[count] = mv[i + 1]
+            self._starts[count] = i + 2
+            self._lens[count] = length - 1
+            count += 1
+            i += 1 + length
+        self._count = count
+        return self
+
+    def __len__(self):
+        return self._count
+
+    def field(self, adv_type):
+        for k in range(self._count):
+            if self._types[k] == adv_type:
+                start = self._starts[k]
+                return self._mv[start:start + self._lens[k]]
+        return None
+
+    def fields(self, adv_type):
+        result = []
+        for k in range(self._count):
+            if self._types[k] == adv_type:
+                start = self._starts[k]
+                result.append(self._mv[start:start + self._lens[k]])
+        return result
+
+    def name(self):
+        if self._name is None:
+            n = self.field(_ADV_TYPE_NAME)
+            self._name = str(n, "utf-8") if n else ""
+        return self._name
+
+    def service_data(self):
+        return self.field(_ADV_TYPE_SERVICE_DATA)
+
+    def services(self):
+        if self._services is None:
+            services = []
+            for k in range(self._count):
+                adv_type = self._types[k]
+                if _ADV_TYPE_UUID16_MORE <= adv_type <= _ADV_TYPE_UUID128_COMPLETE:
+                    size = (2, 4, 16)[(adv_type - _ADV_TYPE_UUID16_MORE) >> 1]
+                    start = self._starts[k]
+                    for i in range(start, start + self._lens[k] - size + 1, size):
+                        services.append(self._uuid(i, size))
+            self._services = services
+        return self._services
+
+    def hasService(self, uuid):
+        # Compares raw bytes; no UUID objects are created.
+        b = uuid if isinstance(uuid, (bytes, bytearray)) else bytes(uuid)
+        size = len(b)
+        mv = self._mv
+        for k in range(self._count):
+            adv_type = self._types[k]
+            if _ADV_TYPE_UUID16_MORE <= adv_type <= _ADV_TYPE_UUID128_COMPLETE \
+                    and (2, 4, 16)[(adv_type - _ADV_TYPE_UUID16_MORE) >> 1] == size:
+                start = self._starts[k]
+                for i in range(start, start + self._lens[k] - size + 1, size):
+                    j = 0
+                    while j < size and mv[i + j] == b[j]:
+                        j += 1
+                    if j == size:
+                        return True
+        return False
+
+    def _uuid(self, i, size):
+        if size == 2:
+            key = struct.unpack_from("<H", self._mv, i)[0]
+        elif size == 4:
+            key = struct.unpack_from("<I", self._mv, i)[0]
+        else:
+            key = bytes(self._mv[i:i + 16])
+        cache = AdvParser._uuids
+        uuid = cache.get(key)
+        if uuid is None:
+            if len(cache) >= _UUID_CACHE_SIZE:
+                cache.clear()
+            uuid = bluetooth.UUID(key)
+            cache[key] = uuid
+        return uuid
+
+
 def decode_field(payload, adv_type):
     i = 0
     result = []
@@ -82,12 +308,16 @@ def decode_name(payload):
 
 def decode_services(payload):
     services = []
+    # A field may list several UUIDs of the same size.
     for u in decode_field(payload, _ADV_TYPE_UUID16_COMPLETE):
-        services.append(bluetooth.UUID(struct.unpack("<h", u)[0]))
+        for i in range(0, len(u) - 1, 2):
+            services.append(bluetooth.UUID(struct.unpack_from("<H", u, i)[0]))
     for u in decode_field(payload, _ADV_TYPE_UUID32_COMPLETE):
-        services.append(bluetooth.UUID(struct.unpack("<d", u)[0]))
+        for i in range(0, len(u) - 3, 4):
+            services.append(bluetooth.UUID(struct.unpack_from("<I", u, i)[0]))
     for u in decode_field(payload, _ADV_TYPE_UUID128_COMPLETE):
-        services.append(bluetooth.UUID(u))
+        for i in range(0, len(u) - 15, 16):
+            services.append(bluetooth.UUID(bytes(u[i:i + 16])))
     return services
 
 def decode_service_data(payload):
@@ -104,6 +334,12 @@ def demo():
     print(decode_name(payload))
     print(decode_services(payload))
     print(decode_service_data(payload))
+    p = AdvertisingPayload.create(
+        name="micropython",
+        services=[bluetooth.UUID(0x181A), bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")],
+        service_data=struct.pack("<HBH", 0x1234, 0x56, 0x7890)
+    )
+    print(p.freeze())
 
 
 if __name__ == "__main__":
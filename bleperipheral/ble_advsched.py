@@ -0,0 +1,135 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import micropython, Periodic, ticks_ms, ticks_diff
+
+try:
+    import machine
+except ImportError:
+    machine = None
+
+
+class AdvScheduler(Periodic):
+    '''
+    Advertises fast after start() and after every disconnect, backs off to
+    a slow interval after fast_ms, and rotates through precomputed payloads
+    every rotate_ms (0: never).
+
+    Use start() instead of BLEPeripheral.advertise(). The IRQ only flags a
+    restart; gap_advertise is called from a scheduled tick, driven by a
+    machine.Timer every period_ms where the port has one, otherwise by
+    tick() or run() from the application.
+
+    parameters
+    ----------
+        peripheral:BLEPeripheral
+            after build()
+
+        payloads:list of AdvertisingPayload,None
+            None: the payload built by build(). update_service_data() patches
+            the payload being advertised.
+    '''
+
+    def __init__(self, peripheral, payloads=None, fast_interval_us=100000, fast_ms=30000,
+                 slow_interval_us=1000000, rotate_ms=0, period_ms=500):
+        self._peripheral = peripheral
+        self._payloads = list(payloads) if payloads else [peripheral.advertisingPayload]
+        self._fast_interval_us = fast_interval_us
+        self._fast_ms = fast_ms
+        self._slow_interval_us = slow_interval_us
+        self._rotate_ms = rotate_ms
+        self._period_ms = period_ms
+        self._index = 0
+        self._fast = True
+        self._restart = False
+        self._phase_start = ticks_ms()
+        self._rotated = self._phase_start
+        self._timer = None
+        self._tick_ref = self._tick
+        self._link_ref = self._on_link
+        self.issued = 0
+
+    @property
+    def phase(self):
+        return "fast" if self._fast else "slow"
+
+    @property
+    def interval_us(self):
+        return self._fast_interval_us if self._fast else self._slow_interval_us
+
+    def start(self):
+        p = self._peripheral
+        p.autoAdvertise = False
+        p.addLinkHook(self._link_ref)
+        self._restart = True
+        if machine and hasattr(machine, "Timer"):
+            self._timer = machine.Timer(-1)
+            self._timer.init(mode=machine.Timer.PERIODIC, period=self._period_ms, callback=self._on_timer)
+        self.tick()
+
+    def stop(self, advertising=True):
+        '''
+        Stops scheduling; advertising goes on at the current interval
+        (handled by BLEPeripheral again) unless advertising is False.
+        '''
+        p = self._peripheral
+        Periodic.stop(self)
+        if self._timer:
+            self._timer.deinit()
+            self._timer = None
+        p.removeLinkHook(self._link_ref)
+        if advertising:
+            p.autoAdvertise = True
+        else:
+            p.stopAdvertising()
+
+    def _on_link(self, conn_handle, connected):
+        # IRQ: flag only, the scheduled tick advertises.
+        self._restart = True
+        self._schedule()
+
+    def _on_timer(self, _timer):
+        self._schedule()
+
+    def _schedule(self):
+        try:
+            micropython.schedule(self._tick_ref, None)
+        except RuntimeError:
+            # Queue full; the next timer period catches up.
+            pass
+
+    def _tick(self, _):
+        self.tick()
+
+    def tick(self):
+        '''
+        returns
+        ----------
+            bool
+                True when advertising was (re)issued.
+        '''
+        p = self._peripheral
+        if not p.canAdvertise():
+            # The stack stopped advertising on connect; nothing to do until a disconnect.
+            self._restart = False
+            return False
+        now = ticks_ms()
+        if self._restart or not p.advertising:
+            self._restart = False
+            self._fast = True
+            self._phase_start = now
+            self._rotated = now
+        elif self._fast and ticks_diff(now, self._phase_start) >= self._fast_ms:
+            self._fast = False
+        elif self._rotate_ms and len(self._payloads) > 1 and ticks_diff(now, self._rotated) >= self._rotate_ms:
+            self._index = (self._index + 1) % len(self._payloads)
+            self._rotated = now
+        else:
+            return False
+        self._issue()
+        return True
+
+    def _issue(self):
+        if self._peripheral.setAdvertising(self._payloads[self._index], self.interval_us):
+            self.issued += 1
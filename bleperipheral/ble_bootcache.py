@@ -0,0 +1,202 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+import struct
+from bleperipheral.util import bluetooth
+
+_MAGIC = b"BLB2"
+# MicroPython's struct raises ValueError on a short buffer and has no struct.error.
+_CORRUPT = (IndexError, ValueError, getattr(struct, "error", ValueError))
+
+
+class BootImage:
+    '''
+    What BLEPeripheral.restore() needs to start advertising: the service
+    definition, the advertising and scan response payloads and the
+    advertising interval, plus the setBuffer sizes and the zero_copy
+    setting. Loaded by load() or defined by a module written with freeze().
+
+    GATTSchema bindings, onWrite/onRead handlers and codecs are Python
+    objects and are not part of the image; see BLEPeripheral.restore().
+
+    parameters
+    ----------
+        buffers:tuple
+            (index, length, append) per setBuffer call, index counting the
+            handles returned by build() across all services.
+    '''
+
+    def __init__(self, definition, adv, resp=None, interval_us=500000, buffers=(), zero_copy=False):
+        self.definition = definition
+        self.adv = adv
+        self.resp = resp
+        self.interval_us = interval_us
+        self.buffers = buffers
+        self.zero_copy = zero_copy
+
+
+def _flatten(definition):
+    # <count:u8> then per entry <uuid_len:u8> <uuid> [<flags:u16 LE>] <children>
+    out = bytearray()
+    out.append(len(definition))
+    for service in definition:
+        b = bytes(service[0])
+        out.append(len(b))
+        out += b
+        out.append(len(service[1]))
+        for characteristic in service[1]:
+            b = bytes(characteristic[0])
+            out.append(len(b))
+            out += b
+            out += struct.pack("<H", characteristic[1])
+            descriptors = characteristic[2] if len(characteristic) > 2 else ()
+            out.append(len(descriptors))
+            for descriptor in descriptors:
+                b = bytes(descriptor[0])
+                out.append(len(b))
+                out += b
+                out += struct.pack("<H", descriptor[1])
+    return out
+
+
+def _unflatten(mv, i):
+    def uuid(i):
+        n = mv[i]
+        return bluetooth.UUID(bytes(mv[i + 1:i + 1 + n])), i + 1 + n
+
+    services = []
+    count = mv[i]
+    i += 1
+    for _ in range(count):
+        service_uuid, i = uuid(i)
+        chars = []
+        nchars = mv[i]
+        i += 1
+        for _ in range(nchars):
+            char_uuid, i = uuid(i)
+            flags = struct.unpack_from("<H", mv, i)[0]
+            i += 2
+            ndescs = mv[i]
+            i += 1
+            if ndescs:
+                descs = []
+                for _ in range(ndescs):
+                    desc_uuid, i = uuid(i)
+                    descs.append((desc_uuid, struct.unpack_from("<H", mv, i)[0]))
+                    i += 2
+                chars.append((char_uuid, flags, tuple(descs)))
+            else:
+                chars.append((char_uuid, flags))
+        services.append((service_uuid, tuple(chars)))
+    return tuple(services), i
+
+
+def image(peripheral):
+    '''
+    returns
+    ----------
+        BootImage
+            of a peripheral after build()
+    '''
+    definition, adv, resp, interval_us, buffers, zero_copy = peripheral.buildSettings()
+    return BootImage(definition, bytes(adv), bytes(resp) if resp else None, interval_us, buffers, zero_copy)
+
+
+def save(peripheral, path, tag=b""):
+    '''
+    Writes the BootImage of peripheral to path.
+
+    file
+    ----------
+        "BLB2" <tag_len:u8> <tag> <interval_us:u32> <adv_len:u8> <adv>
+        <resp_len:u8> <resp> <definition> <zero_copy:u8> <buffer_count:u8>
+        then per buffer <index:u8> <length:u16 LE> <append:u8>
+    '''
+    img = image(peripheral)
+    with open(path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(bytes((len(tag),)))
+        f.write(tag)
+        f.write(struct.pack("<I", img.interval_us))
+        for payload in (img.adv, img.resp or b""):
+            f.write(bytes((len(payload),)))
+            f.write(payload)
+        f.write(_flatten(img.definition))
+        f.write(bytes((1 if img.zero_copy else 0, len(img.buffers))))
+        for index, length, append in img.buffers:
+            f.write(struct.pack("<BHB", index, length, 1 if append else 0))
+
+
+def load(path, tag=b""):
+    '''
+    returns
+    ----------
+        BootImage
+            from path, or None when it is missing, corrupt or saved with
+            another tag (bump the tag when the services change).
+    '''
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    mv = memoryview(data)
+    try:
+        if bytes(mv[0:4]) != _MAGIC:
+            return None
+        i = 5 + mv[4]
+        if bytes(mv[5:i]) != tag:
+            return None
+        interval_us = struct.unpack_from("<I", mv, i)[0]
+        i += 4
+        n = mv[i]
+        adv = mv[i + 1:i + 1 + n]
+        i += 1 + n
+        n = mv[i]
+        resp = mv[i + 1:i + 1 + n] if n else None
+        i += 1 + n
+        definition, i = _unflatten(mv, i)
+        zero_copy = mv[i] != 0
+        count = mv[i + 1]
+        i += 2
+        buffers = []
+        for _ in range(count):
+            index, length, append = struct.unpack_from("<BHB", mv, i)
+            buffers.append((index, length, append != 0))
+            i += 4
+    except _CORRUPT:
+        return None
+    return BootImage(definition, adv, resp, interval_us, tuple(buffers), zero_copy)
+
+
+def _literal(uuid):
+    return "bluetooth.UUID({})".format(repr(bytes(uuid)))
+
+
+def freeze(peripheral, path):
+    '''
+    Writes the BootImage of peripheral as a Python module, to be frozen
+    with manifest.py so the payloads stay in flash:
+
+        from ble_boot_image import IMAGE
+        handles = peripheral.restore(IMAGE)
+    '''
+    img = image(peripheral)
+    with open(path, "w") as f:
+        f.write("# Generated by bleperipheral.ble_bootcache.freeze().\n")
+        f.write("import bluetooth\n")
+        f.write("from bleperipheral.ble_bootcache import BootImage\n\n")
+        f.write("IMAGE = BootImage(\n    (\n")
+        for service in img.definition:
+            f.write("        ({}, (\n".format(_literal(service[0])))
+            for characteristic in service[1]:
+                if len(characteristic) > 2:
+                    descs = ", ".join("({}, {})".format(_literal(d[0]), d[1]) for d in characteristic[2])
+                    f.write("            ({}, {}, ({},)),\n".format(_literal(characteristic[0]), characteristic[1], descs))
+                else:
+                    f.write("            ({}, {}),\n".format(_literal(characteristic[0]), characteristic[1]))
+            f.write("        )),\n")
+        f.write("    ),\n")
+        f.write("    {},\n    {},\n    {},\n".format(repr(img.adv), repr(img.resp), img.interval_us))
+        f.write("    {},\n    {},\n)\n".format(repr(img.buffers), img.zero_copy))
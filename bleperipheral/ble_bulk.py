@@ -0,0 +1,228 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+import struct
+from bleperipheral.util import uasyncio as asyncio, const, isBusy, ticks_ms, ticks_diff
+
+
+_HEADER = const(2)
+
+_CTRL_ACK    = const(0x01)
+_CTRL_RESUME = const(0x02)
+_CTRL_ABORT  = const(0x03)
+
+
+class _BufferSource:
+    def __init__(self, data):
+        self._mv = memoryview(data)
+
+    def readinto(self, mv, offset):
+        n = len(self._mv) - offset
+        if n > len(mv):
+            n = len(mv)
+        if n <= 0:
+            return 0
+        mv[0:n] = self._mv[offset:offset + n]
+        return n
+
+
+class _FileSource:
+    def __init__(self, f):
+        self._f = f
+        self._pos = 0
+
+    def readinto(self, mv, offset):
+        if offset != self._pos:
+            self._f.seek(offset)
+        n = 0
+        while n < len(mv):
+            k = self._f.readinto(mv[n:] if n else mv)
+            if not k:
+                break
+            n += k
+        self._pos = offset + n
+        return n
+
+
+class _IterSource:
+    def __init__(self, it):
+        self._it = iter(it)
+        self._chunk = None
+        self._at = 0
+        self._pos = 0
+
+    def readinto(self, mv, offset):
+        if offset != self._pos:
+            raise ValueError("source cannot rewind")
+        n = 0
+        while n < len(mv):
+            if self._chunk is None or self._at == len(self._chunk):
+                try:
+                    self._chunk = memoryview(next(self._it))
+                except StopIteration:
+                    break
+                self._at = 0
+            k = len(self._chunk) - self._at
+            if k > len(mv) - n:
+                k = len(mv) - n
+            mv[n:n + k] = self._chunk[self._at:self._at + k]
+            self._at += k
+            n += k
+        self._pos += n
+        return n
+
+
+class BulkSender:
+    '''
+    Streams a bytes-like object, a file or an iterator of bytes to one
+    central as back-to-back notifications.
+
+    frame
+    ----------
+        <seq:uint16 LE> <payload>
+        seq is offset // payload_size (mod 0x10000); every payload but the
+        last is payload_size bytes. A frame without payload ends the transfer.
+        payload_size defaults to what the negotiated MTU allows (mtu - 5).
+
+    control characteristic (optional, written by the central)
+    ----------
+        0x01 <offset:uint32 LE>    acknowledge bytes received in order
+        0x02 <offset:uint32 LE>    resume from offset (rounded down to a frame)
+        0x03                       abort
+
+        With a control characteristic at most `window` frames are sent
+        beyond the acknowledged offset, and the transfer resumes from it
+        when no acknowledgement arrives within ack_timeout_ms. Resuming
+        needs a bytes-like object or a seekable file.
+        The control characteristic is registered with peripheral.onWrite.
+    '''
+
+    def __init__(self, peripheral, data_handle, control_handle=None, payload_size=None, window=8, ack_timeout_ms=2000, retry_ms=5):
+        self._peripheral = peripheral
+        self._data_handle = data_handle
+        self._control_handle = control_handle
+        self._payload_size = payload_size
+        self._window = window
+        self._ack_timeout_ms = ack_timeout_ms
+        self._retry_ms = retry_ms
+        self._size = 0
+        self._buf = None
+        self._mv = None
+        self._flag = asyncio.ThreadSafeFlag()
+        self._reset()
+        if control_handle is not None:
+            peripheral.onWrite(control_handle, self.onControlWrite)
+
+    def _reset(self):
+        self._frames = 0
+        self._offset = 0
+        self._acked = 0
+        self._aborted = False
+        self._bytes = 0
+        self._retransmits = 0
+        self._start = ticks_ms()
+        self._elapsed = 0
+
+    def onControlWrite(self, conn_handle, value_handle, value):
+        if value_handle != self._control_handle or not value:
+            return
+        op = value[0]
+        if op == _CTRL_ABORT:
+            self._aborted = True
+        elif len(value) >= 5:
+            offset = struct.unpack_from("<I", value, 1)[0]
+            if op == _CTRL_ACK:
+                if offset > self._offset:
+                    offset = self._offset
+                if offset > self._acked:
+                    self._acked = offset
+            elif op == _CTRL_RESUME:
+                # Resuming past what was sent would skip unsent data.
+                if offset > self._offset:
+                    offset = self._offset
+                if self._size:
+                    offset -= offset % self._size
+                self._acked = offset
+                self._offset = offset
+                self._retransmits += 1
+        self._flag.set()
+
+    async def send(self, source, conn_handle):
+        '''
+        parameters
+        ----------
+            source:bytes,bytearray,memoryview,file,iterator
+
+            conn_handle:int
+
+        returns
+        ----------
+            int
+                bytes sent (the end offset)
+        '''
+        if hasattr(source, "readinto"):
+            src = _FileSource(source)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            src = _BufferSource(source)
+        else:
+            src = _IterSource(source)
+        self._reset()
+        size = self._payload_size or self._peripheral.maxPayload(conn_handle) - _HEADER
+        if self._buf is None or len(self._buf) < _HEADER + size:
+            self._buf = bytearray(_HEADER + size)
+            self._mv = memoryview(self._buf)
+        self._size = size
+        limit = self._window * size
+        control = self._control_handle is not None
+        payload = self._mv[_HEADER:_HEADER + size]
+        frame = self._mv[0:_HEADER + size]
+        ended = False
+        while not self._aborted:
+            if control and (ended or self._offset - self._acked >= limit):
+                if ended and self._acked >= self._offset:
+                    break
+                offset = self._offset
+                try:
+                    await asyncio.wait_for_ms(self._flag.wait(), self._ack_timeout_ms)
+                except asyncio.TimeoutError:
+                    self._offset = self._acked
+                    self._retransmits += 1
+                if self._offset != offset:
+                    # Rewound by a timeout or a resume request.
+                    ended = False
+                continue
+            if ended:
+                break
+            n = src.readinto(payload, self._offset)
+            struct.pack_into("<H", self._buf, 0, (self._offset // size) & 0xFFFF)
+            try:
+                self._peripheral.gattsNotify(conn_handle, self._data_handle, frame if n == size else frame[0:_HEADER + n])
+            except OSError as e:
+                if isBusy(e):
+                    await asyncio.sleep_ms(self._retry_ms)
+                    continue
+                raise
+            self._frames += 1
+            self._offset += n
+            self._bytes += n
+            if n == 0:
+                ended = True
+            elif not control and self._frames % self._window == 0:
+                await asyncio.sleep_ms(0)
+        self._elapsed = ticks_diff(ticks_ms(), self._start)
+        return self._offset
+
+    @property
+    def bytesSent(self):
+        # Includes retransmitted bytes.
+        return self._bytes
+
+    @property
+    def retransmits(self):
+        return self._retransmits
+
+    @property
+    def bytesPerSecond(self):
+        ms = self._elapsed or ticks_diff(ticks_ms(), self._start)
+        return self._bytes * 1000 // ms if ms > 0 else 0
@@ -0,0 +1,105 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+import struct
+
+
+class StructCodec:
+    '''
+    Packs characteristic values with a fixed struct format into one of two
+    preallocated buffers, so periodic updates do not allocate.
+
+    parameters
+    ----------
+        fmt:str
+            struct format, e.g. "<h"
+
+        scale:int,float,None
+            encode packs round(value * scale), decode returns data / scale.
+
+    Use one codec per characteristic: encode() returns a memoryview that
+    stays valid until the next-but-one encode().
+    '''
+
+    def __init__(self, fmt, scale=None):
+        self._fmt = fmt
+        self._scale = scale
+        self.size = struct.calcsize(fmt)
+        self._bufs = (bytearray(self.size), bytearray(self.size))
+        self._mvs = (memoryview(self._bufs[0]), memoryview(self._bufs[1]))
+        self._cur = 0
+        self._valid = False
+
+    def _pack(self, buf, value):
+        if self._scale is not None:
+            value = round(value * self._scale)
+        struct.pack_into(self._fmt, buf, 0, value)
+
+    def encode(self, value):
+        cur = self._cur ^ 1
+        self._pack(self._bufs[cur], value)
+        self._cur = cur
+        self._valid = True
+        return self._mvs[cur]
+
+    def update(self, value):
+        '''
+        returns
+        ----------
+            memoryview
+                the encoded value, or None when it equals the last one.
+        '''
+        nxt = self._cur ^ 1
+        self._pack(self._bufs[nxt], value)
+        if self._valid and self._bufs[nxt] == self._bufs[self._cur]:
+            return None
+        self._cur = nxt
+        self._valid = True
+        return self._mvs[nxt]
+
+    def reset(self):
+        # The next update() encodes even an unchanged value.
+        self._valid = False
+
+    def decode(self, data):
+        value = struct.unpack_from(self._fmt, data, 0)[0]
+        if self._scale is not None:
+            return value / self._scale
+        return value
+
+
+class SInt16(StructCodec):
+    def __init__(self, scale=None):
+        super().__init__("<h", scale)
+
+
+class UInt8(StructCodec):
+    def __init__(self, scale=None):
+        super().__init__("<B", scale)
+
+
+class UInt16(StructCodec):
+    def __init__(self, scale=None):
+        super().__init__("<H", scale)
+
+
+class Float32(StructCodec):
+    def __init__(self):
+        super().__init__("<f")
+
+
+class Record(StructCodec):
+    '''
+    Fixed-layout record; values are tuples matching fmt, e.g.
+    Record("<hHB") for (sint16, uint16, uint8).
+    '''
+
+    def __init__(self, fmt):
+        super().__init__(fmt)
+
+    def _pack(self, buf, value):
+        struct.pack_into(self._fmt, buf, 0, *value)
+
+    def decode(self, data):
+        return struct.unpack_from(self._fmt, data, 0)
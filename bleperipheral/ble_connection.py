@@ -0,0 +1,106 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import const, ticks_ms
+
+_DEFAULT_MTU = const(23)
+
+
+class Connection:
+    '''
+    State of one connected central. Owned by BLEPeripheral, which hands
+    out copies (see BLEPeripheral.connection()).
+
+        handle, addr_type, addr (bytes), mtu, since (ticks_ms at connect),
+        writes/rx_bytes received, notifies/tx_bytes sent by notify() and
+        write(..., notify=True), and the connection parameters reported by
+        _IRQ_CONNECTION_UPDATE: interval (1.25 ms units), latency and
+        timeout (10 ms units), 0 until the first update.
+    '''
+    __slots__ = (
+        "handle", "addr_type", "_addr", "mtu", "since", "writes", "rx_bytes", "notifies", "tx_bytes",
+        "interval", "latency", "timeout",
+    )
+
+    def __init__(self):
+        self._addr = bytearray(6)
+        self._reset(None, 0, None)
+
+    def _reset(self, conn_handle, addr_type, addr):
+        self.handle = conn_handle
+        self.addr_type = addr_type
+        if addr is not None:
+            self._addr[:] = addr
+        self.mtu = _DEFAULT_MTU
+        self.since = ticks_ms()
+        self.writes = 0
+        self.rx_bytes = 0
+        self.notifies = 0
+        self.tx_bytes = 0
+        self.interval = 0
+        self.latency = 0
+        self.timeout = 0
+
+    def copy(self):
+        c = Connection()
+        for name in Connection.__slots__:
+            setattr(c, name, getattr(self, name))
+        c._addr = bytearray(self._addr)
+        return c
+
+    @property
+    def addr(self):
+        return bytes(self._addr)
+
+
+class ConnectionTable:
+    '''
+    Connection records indexed by conn_handle.
+
+    size records are preallocated and reused; connecting takes one from
+    the free list without allocating, more are created only when a port
+    allows more connections than expected. Iterating yields the
+    conn_handles, like the set it replaces.
+    '''
+
+    def __init__(self, size):
+        self._index = {}
+        self._free = [Connection() for _ in range(size)]
+
+    def open(self, conn_handle, addr_type, addr):
+        c = self._index.get(conn_handle)
+        if c is None:
+            c = self._free.pop() if self._free else Connection()
+            self._index[conn_handle] = c
+        c._reset(conn_handle, addr_type, addr)
+        return c
+
+    def close(self, conn_handle):
+        c = self._index.pop(conn_handle, None)
+        if c is not None:
+            self._free.append(c)
+        return c
+
+    def get(self, conn_handle):
+        return self._index.get(conn_handle)
+
+    def handles(self):
+        # A snapshot, safe to iterate while connections come and go.
+        return tuple(self._index)
+
+    def records(self):
+        return self._index.values()
+
+    def clear(self):
+        for conn_handle in self.handles():
+            self.close(conn_handle)
+
+    def __contains__(self, conn_handle):
+        return conn_handle in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
@@ -0,0 +1,168 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import Periodic, ticks_ms, ticks_diff
+
+
+class Profile:
+    '''
+    Connection parameters to request.
+
+    parameters
+    ----------
+        name:str
+
+        min_interval, max_interval:int
+            1.25 ms units (6 = 7.5 ms ... 3200 = 4 s)
+
+        latency:int
+            connection events the peripheral may skip
+
+        timeout:int
+            supervision timeout, 10 ms units
+    '''
+
+    def __init__(self, name, min_interval, max_interval, latency=0, timeout=400):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.latency = latency
+        self.timeout = timeout
+
+
+PROFILE_BURST = Profile("burst", 6, 12, 0, 200)
+PROFILE_BALANCED = Profile("balanced", 24, 40, 0, 400)
+PROFILE_IDLE = Profile("idle", 80, 160, 4, 600)
+
+
+class _State:
+    def __init__(self, now):
+        self.events = 0
+        self.stamp = now
+        self.quiet_since = now
+        self.profile = None
+        self.requested = None
+        self.requested_at = now
+        self.rate = 0
+
+
+class ConnParamPolicy(Periodic):
+    '''
+    Picks connection parameters from the traffic of each connection.
+
+    tick() computes the traffic rate of every connection since the previous
+    tick: writes received plus every notification sent through
+    BLEPeripheral.gattsNotify(), which covers notify(), the NotifyScheduler,
+    streams, bulk transfers and RPC replies (see BLEPeripheral.traffic()).
+    At or above burst_rate (events/s) it switches to the burst profile at
+    once. Only after the rate has stayed at or below idle_rate for idle_ms
+    does it switch to the idle profile. Rates in between keep the current
+    profile. A profile is requested at most once
+    per min_request_ms per connection.
+
+    The parameters are handed to requester(conn_handle, profile). MicroPython
+    has no peripheral-side update request, so without a requester the
+    policy only reports desired(); pass one for ports or firmware that
+    expose it. The parameters actually in effect come from
+    _IRQ_CONNECTION_UPDATE, see interval() and Connection.interval.
+    '''
+
+    def __init__(self, peripheral, burst=PROFILE_BURST, idle=PROFILE_IDLE, initial=PROFILE_BALANCED,
+                 burst_rate=20, idle_rate=2, idle_ms=3000, min_request_ms=1000, requester=None):
+        self._peripheral = peripheral
+        self._burst = burst
+        self._idle = idle
+        self._initial = initial
+        self._burst_rate = burst_rate
+        self._idle_rate = idle_rate
+        self._idle_ms = idle_ms
+        self._min_request_ms = min_request_ms
+        self._requester = requester
+        self._states = {}
+        self.requests = 0
+
+    # run() ticks every 500 ms.
+    _period_ms = 500
+
+    def _state(self, conn_handle, events, now):
+        st = self._states.get(conn_handle)
+        if st is None:
+            st = _State(now)
+            st.events = events
+            # Whatever the central picked stands until the traffic changes.
+            st.profile = st.requested = self._initial
+            self._states[conn_handle] = st
+        return st
+
+    def tick(self):
+        '''
+        returns
+        ----------
+            int
+                number of parameter requests issued
+        '''
+        now = ticks_ms()
+        issued = 0
+        peripheral = self._peripheral
+        connections = peripheral.connections()
+        for conn_handle in list(self._states):
+            if conn_handle not in connections:
+                del self._states[conn_handle]
+        for conn_handle in connections:
+            events = peripheral.traffic(conn_handle)
+            st = self._state(conn_handle, events, now)
+            ms = ticks_diff(now, st.stamp)
+            if ms <= 0:
+                continue
+            st.rate = (events - st.events) * 1000 // ms
+            st.events = events
+            st.stamp = now
+            if st.rate > self._idle_rate:
+                st.quiet_since = now
+            if st.rate >= self._burst_rate:
+                st.profile = self._burst
+            elif ticks_diff(now, st.quiet_since) >= self._idle_ms:
+                st.profile = self._idle
+            if st.profile is not st.requested and self._request(conn_handle, st, now):
+                issued += 1
+        return issued
+
+    def _request(self, conn_handle, st, now):
+        if ticks_diff(now, st.requested_at) < self._min_request_ms:
+            return False
+        if not self._requester:
+            return False
+        try:
+            self._requester(conn_handle, st.profile)
+        except OSError:
+            return False
+        st.requested = st.profile
+        st.requested_at = now
+        self.requests += 1
+        return True
+
+    def desired(self, conn_handle):
+        '''
+        returns
+        ----------
+            Profile,None
+        '''
+        st = self._states.get(conn_handle)
+        return st.profile if st else None
+
+    def rate(self, conn_handle):
+        # Traffic events per second over the last tick, see BLEPeripheral.traffic().
+        st = self._states.get(conn_handle)
+        return st.rate if st else 0
+
+    def interval(self, conn_handle):
+        '''
+        returns
+        ----------
+            int
+                effective connection interval in microseconds, 0 when the
+                stack has not reported one.
+        '''
+        c = self._peripheral.connection(conn_handle)
+        return c.interval * 1250 if c else 0
@@ -0,0 +1,148 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from array import array
+from bleperipheral.util import uasyncio as asyncio, const
+
+OVERFLOW_DROP_OLDEST = const(0)
+OVERFLOW_COALESCE    = const(1)
+
+_IRQ_GATTS_WRITE = const(3)
+
+
+class EventRing:
+    '''
+    Fixed-size queue of IRQ events, stored in preallocated parallel arrays
+    so that push() does not allocate.
+
+    A write slot whose data is None is read from the stack when it is
+    dispatched; such slots can absorb later writes to the same handle.
+    With OVERFLOW_COALESCE a write is only merged that way when the ring
+    is full; the caller reads the value itself otherwise (see full()).
+    '''
+
+    def __init__(self, capacity=16, overflow=OVERFLOW_DROP_OLDEST):
+        if capacity < 1:
+            raise ValueError("capacity")
+        self._capacity = capacity
+        self._overflow = overflow
+        self._event = bytearray(capacity)
+        self._conn = array("h", [0] * capacity)
+        self._handle = array("H", [0] * capacity)
+        self._data = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def overflow(self):
+        return self._overflow
+
+    def full(self):
+        return self._count == self._capacity
+
+    def push(self, event, conn_handle, value_handle, data, coalesce=False):
+        if event == _IRQ_GATTS_WRITE and data is None and \
+                (coalesce or (self._overflow == OVERFLOW_COALESCE and self._count == self._capacity)):
+            i = self._head
+            for _ in range(self._count):
+                if self._event[i] == _IRQ_GATTS_WRITE and self._handle[i] == value_handle \
+                        and self._conn[i] == conn_handle and self._data[i] is None:
+                    self.coalesced += 1
+                    return
+                i += 1
+                if i == self._capacity:
+                    i = 0
+        if self._count == self._capacity:
+            self._data[self._head] = None
+            self._head += 1
+            if self._head == self._capacity:
+                self._head = 0
+            self._count -= 1
+            self.dropped += 1
+        i = self._head + self._count
+        if i >= self._capacity:
+            i -= self._capacity
+        self._event[i] = event
+        self._conn[i] = conn_handle
+        self._handle[i] = value_handle
+        self._data[i] = data
+        self._count += 1
+
+    def peek(self):
+        # Slot index of the oldest event; read it with event()/conn()/handle()/data().
+        return self._head
+
+    def event(self, i):
+        return self._event[i]
+
+    def conn(self, i):
+        return self._conn[i]
+
+    def handle(self, i):
+        return self._handle[i]
+
+    def data(self, i):
+        return self._data[i]
+
+    def pop(self):
+        self._data[self._head] = None
+        self._head += 1
+        if self._head == self._capacity:
+            self._head = 0
+        self._count -= 1
+
+    def clear(self):
+        for i in range(self._capacity):
+            self._data[i] = None
+        self._head = 0
+        self._count = 0
+
+
+class EventStream:
+    '''
+    Async iterator returned by BLEPeripheral.events().
+    Each item is (event, conn_handle, value_handle, value).
+    When the consumer falls behind, put() drops the oldest event.
+    '''
+
+    def __init__(self, capacity, detach):
+        self._ring = EventRing(capacity)
+        self._flag = asyncio.ThreadSafeFlag()
+        self._detach = detach
+
+    def full(self):
+        return self._ring.full()
+
+    @property
+    def dropped(self):
+        return self._ring.dropped
+
+    def put(self, event, conn_handle, value_handle, data):
+        self._ring.push(event, conn_handle, value_handle, data)
+        self._flag.set()
+
+    def close(self):
+        self._ring.clear()
+        self._detach()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        ring = self._ring
+        while not len(ring):
+            await self._flag.wait()
+        i = ring.peek()
+        item = (ring.event(i), ring.conn(i), ring.handle(i), ring.data(i))
+        ring.pop()
+        return item
@@ -0,0 +1,121 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import const
+
+_FLAG_READ_AUTHORIZED = const(0x0200)
+
+
+class Descriptor:
+    def __init__(self, name, uuid, flags):
+        self.name = name
+        self.uuid = uuid
+        self.flags = flags
+        self.handle = None
+
+
+class Characteristic:
+    '''
+    parameters
+    ----------
+        name:str
+
+        uuid:UUID
+
+        flags:int
+
+        buffer_size:int,None
+            setBuffer(handle, buffer_size, append) is called after registration.
+
+        append:bool
+
+        codec:object,None
+            encode(value) -> bytes and decode(data) -> value, e.g. SInt16(100).
+            BLEPeripheral.writeValue also needs update(value) -> bytes or None.
+
+        descriptors:tuple of Descriptor
+
+        on_write:Function,Generator,BoundMethod,None
+            Registered with BLEPeripheral.onWrite by build().
+
+        on_read:Function,BoundMethod,None
+            Registered with BLEPeripheral.onRead(handle, on_read, read_ttl_ms)
+            by build(); the characteristic is flagged read-authorized.
+
+        read_ttl_ms:int
+    '''
+
+    def __init__(self, name, uuid, flags, buffer_size=None, append=False, codec=None, descriptors=None, on_write=None, on_read=None, read_ttl_ms=0):
+        self.name = name
+        self.uuid = uuid
+        self.flags = flags
+        self.buffer_size = buffer_size
+        self.append = append
+        self.codec = codec
+        self.descriptors = tuple(descriptors) if descriptors else ()
+        self.on_write = on_write
+        self.on_read = on_read
+        self.read_ttl_ms = read_ttl_ms
+        self.handle = None
+
+    def encode(self, value):
+        return self.codec.encode(value) if self.codec else value
+
+    def decode(self, data):
+        return self.codec.decode(data) if self.codec else data
+
+
+class Service:
+    def __init__(self, uuid, characteristics, name=None):
+        self.name = name
+        self.uuid = uuid
+        self.characteristics = tuple(characteristics)
+
+
+class GATTSchema:
+    '''
+    Declarative service definition, compiled once.
+
+    definition is the tuple passed to gatts_register_services; after
+    registration (BLEPeripheral.build does it) handles maps every
+    characteristic and descriptor name to its handle and characteristics
+    maps every value handle to its Characteristic.
+    '''
+
+    def __init__(self, services):
+        self.services = tuple(services)
+        definition = []
+        for service in self.services:
+            chars = []
+            for c in service.characteristics:
+                flags = c.flags | _FLAG_READ_AUTHORIZED if c.on_read else c.flags
+                if c.descriptors:
+                    chars.append((c.uuid, flags, tuple((d.uuid, d.flags) for d in c.descriptors)))
+                else:
+                    chars.append((c.uuid, flags))
+            definition.append((service.uuid, tuple(chars)))
+        self.definition = tuple(definition)
+        self.handles = {}
+        self.characteristics = {}
+
+    def bind(self, handles):
+        self.handles.clear()
+        self.characteristics.clear()
+        for service, service_handles in zip(self.services, handles):
+            i = 0
+            for c in service.characteristics:
+                c.handle = service_handles[i]
+                i += 1
+                self.handles[c.name] = c.handle
+                self.characteristics[c.handle] = c
+                for d in c.descriptors:
+                    d.handle = service_handles[i]
+                    i += 1
+                    self.handles[d.name] = d.handle
+
+    def handle(self, name):
+        return self.handles[name]
+
+    def characteristic(self, value_handle):
+        return self.characteristics.get(value_handle)
@@ -0,0 +1,155 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+import struct
+from array import array
+from bleperipheral.util import bluetooth, const, ticks_ms, ticks_diff
+
+# Counter indices.
+IRQ             = const(0)
+IRQ_CONNECT     = const(1)
+IRQ_DISCONNECT  = const(2)
+IRQ_WRITE       = const(3)
+IRQ_READ        = const(4)
+SCHEDULE_FULL   = const(5)
+NOTIFY          = const(6)
+NOTIFY_FAILED   = const(7)
+WRITE           = const(8)
+ADVERTISE       = const(9)
+_COUNTERS       = const(10)
+
+COUNTER_NAMES = (
+    "irq", "irq_connect", "irq_disconnect", "irq_write", "irq_read",
+    "schedule_full", "notify", "notify_failed", "write", "advertise",
+)
+
+# Log2 buckets: bucket b counts values in [2**(b-1), 2**b), bucket 0 counts 0.
+_BUCKETS = const(16)
+
+_FLAG_READ            = const(0x0002)
+_FLAG_READ_AUTHORIZED = const(0x0200)
+
+_DIAG_UUID = bluetooth.UUID("7D3A0001-6C4E-4F5B-9A2E-1B8C5D6E7F00")
+_DIAG_METRICS = (
+    bluetooth.UUID("7D3A0002-6C4E-4F5B-9A2E-1B8C5D6E7F00"),
+    _FLAG_READ | _FLAG_READ_AUTHORIZED,
+)
+# Add to the services given to BLEPeripheral.build, then Metrics.attach().
+DIAGNOSTICS_SERVICE = (
+    _DIAG_UUID,
+    (_DIAG_METRICS,),
+)
+
+
+def _bucket(value):
+    b = 0
+    while value and b < _BUCKETS - 1:
+        value >>= 1
+        b += 1
+    return b
+
+
+class Metrics:
+    '''
+    Counters and log2 histograms in preallocated arrays, cheap enough to
+    update from the IRQ.
+
+        counters[IRQ..ADVERTISE]    event counts since reset()
+        irq_us                      time spent in the IRQ handler
+        latency_us                  IRQ to scheduled drain
+
+    Enable with BLEPeripheral.metrics().
+    '''
+
+    def __init__(self):
+        self.counters = array("I", [0] * _COUNTERS)
+        self.irq_us = array("I", [0] * _BUCKETS)
+        self.latency_us = array("I", [0] * _BUCKETS)
+        self._start = ticks_ms()
+        self._buf = None
+        self._peripheral = None
+
+    def reset(self):
+        for a in (self.counters, self.irq_us, self.latency_us):
+            for i in range(len(a)):
+                a[i] = 0
+        self._start = ticks_ms()
+
+    def observe(self, histogram, us):
+        histogram[_bucket(us)] += 1
+
+    def rate(self, counter):
+        '''
+        returns
+        ----------
+            int
+                counter per second since reset()
+        '''
+        ms = ticks_diff(ticks_ms(), self._start)
+        return self.counters[counter] * 1000 // ms if ms > 0 else 0
+
+    @staticmethod
+    def percentile(histogram, p):
+        '''
+        returns
+        ----------
+            int
+                upper bound (2**bucket) of the bucket holding the p-th percentile
+        '''
+        total = sum(histogram)
+        if not total:
+            return 0
+        rank = (total * p + 99) // 100
+        n = 0
+        for b in range(_BUCKETS):
+            n += histogram[b]
+            if n >= rank:
+                return 1 << b
+        return 1 << (_BUCKETS - 1)
+
+    def snapshot(self):
+        d = {}
+        for i in range(_COUNTERS):
+            d[COUNTER_NAMES[i]] = self.counters[i]
+        d["irq_per_s"] = self.rate(IRQ)
+        d["irq_us_p50"] = self.percentile(self.irq_us, 50)
+        d["irq_us_p99"] = self.percentile(self.irq_us, 99)
+        d["latency_us_p50"] = self.percentile(self.latency_us, 50)
+        d["latency_us_p99"] = self.percentile(self.latency_us, 99)
+        if self._peripheral:
+            d["events_dropped"] = self._peripheral.droppedEvents
+        return d
+
+    def size(self):
+        return 4 + 4 * _COUNTERS + 2 * 4 * _BUCKETS
+
+    def pack_into(self, buf, offset=0):
+        '''
+        <uptime_ms:uint32> <counters:uint32 x 10> <irq_us:uint32 x 16> <latency_us:uint32 x 16>
+        all little endian.
+        '''
+        struct.pack_into("<I", buf, offset, ticks_diff(ticks_ms(), self._start) & 0xFFFFFFFF)
+        offset += 4
+        for a in (self.counters, self.irq_us, self.latency_us):
+            for v in a:
+                struct.pack_into("<I", buf, offset, v)
+                offset += 4
+        return offset
+
+    def attach(self, peripheral, value_handle, ttl_ms=1000):
+        '''
+        Serves pack_into() on reads of value_handle, the characteristic of
+        DIAGNOSTICS_SERVICE.
+
+        The value is longer than one ATT packet, so a central reads it with
+        several read (blob) requests. One snapshot serves all the requests
+        within ttl_ms, so the parts it assembles belong together.
+        '''
+        self._buf = bytearray(self.size())
+        peripheral.setBuffer(value_handle, len(self._buf))
+        peripheral.onRead(value_handle, self._read, ttl_ms)
+
+    def _read(self, conn_handle, value_handle):
+        self.pack_into(self._buf)
+        return self._buf
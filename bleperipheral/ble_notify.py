@@ -0,0 +1,189 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import const, isBusy, Periodic, ticks_ms, ticks_diff
+
+_ENOMEM = const(12)
+
+
+class _Queue:
+    def __init__(self):
+        self.handles = []
+        self.data = []
+        self.stalled = False
+        self.sent = 0
+        self.bytes = 0
+        self.merged = 0
+        self.dropped = 0
+        self.busy = 0
+        self.start = ticks_ms()
+
+
+class NotifyScheduler(Periodic):
+    '''
+    Per-connection notification queues, drained round-robin.
+
+    Notifications queue in order, at most max_pending per connection, and
+    are never merged unless their characteristic was marked with latest():
+    then a queued payload is replaced by the next one ("latest value wins")
+    and, when the queue is full, the oldest such payload makes room.
+    A notification that finds no room otherwise raises OSError(ENOMEM),
+    as the stack does, before it is queued for any connection.
+
+    pump() sends until the stack refuses (ENOMEM/EAGAIN/EBUSY) and leaves
+    the rest for the next pump(), so one slow central does not hold up
+    the others or the caller.
+    '''
+
+    def __init__(self, peripheral, max_pending=8):
+        self._notify = peripheral.gattsNotify
+        self._max_pending = max_pending
+        self._latest = set()
+        self._queues = {}
+        self._order = []
+        self._next = 0
+
+    def latest(self, char_handle, enable=True):
+        '''
+        Lets queued notifications of char_handle be replaced by newer ones.
+        Only for state such as sensor values; stream characteristics must
+        keep every payload.
+        '''
+        if enable:
+            self._latest.add(char_handle)
+        else:
+            self._latest.discard(char_handle)
+
+    def _queue(self, conn_handle):
+        q = self._queues.get(conn_handle)
+        if q is None:
+            q = _Queue()
+            self._queues[conn_handle] = q
+            self._order.append(conn_handle)
+        return q
+
+    def remove(self, conn_handle):
+        if self._queues.pop(conn_handle, None) is not None:
+            self._order.remove(conn_handle)
+
+    def _room(self, q, char_handle):
+        # Slot index to overwrite, len(q.handles) to append, -1 when full.
+        latest = self._latest
+        if char_handle in latest:
+            for i in range(len(q.handles)):
+                if q.handles[i] == char_handle:
+                    return i
+        n = len(q.handles)
+        if n < self._max_pending:
+            return n
+        if char_handle in latest:
+            for i in range(n):
+                if q.handles[i] in latest:
+                    return n
+        return -1
+
+    def notify(self, conn_handles, char_handle, data):
+        for conn_handle in conn_handles:
+            q = self._queues.get(conn_handle)
+            if q is not None and self._room(q, char_handle) < 0:
+                raise OSError(_ENOMEM)
+        copy = None
+        for conn_handle in conn_handles:
+            q = self._queue(conn_handle)
+            if not q.handles and not q.stalled:
+                # Nothing queued ahead of it: straight to the stack, no copy.
+                if self._send(conn_handle, q, char_handle, data) is not False:
+                    continue
+            if copy is None:
+                # Queued past the caller's return: keep our own bytes.
+                copy = data if type(data) is bytes else bytes(data)
+            i = self._room(q, char_handle)
+            if i < len(q.handles):
+                q.data[i] = copy
+                q.merged += 1
+                continue
+            if i == self._max_pending:
+                # Full: the oldest replaceable payload makes room.
+                latest = self._latest
+                for k in range(i):
+                    if q.handles[k] in latest:
+                        q.handles.pop(k)
+                        q.data.pop(k)
+                        q.dropped += 1
+                        break
+            q.handles.append(char_handle)
+            q.data.append(copy)
+
+    def pump(self):
+        '''
+        returns
+        ----------
+            int
+                number of notifications handed to the stack
+        '''
+        order = self._order
+        n = len(order)
+        sent = 0
+        idle = 0
+        i = self._next
+        while idle < n:
+            if i >= n:
+                i = 0
+            conn_handle = order[i]
+            q = self._queues[conn_handle]
+            if q.handles and not q.stalled and self._send(conn_handle, q, q.handles[0], q.data[0]):
+                q.handles.pop(0)
+                q.data.pop(0)
+                sent += 1
+                idle = 0
+            else:
+                idle += 1
+            if len(order) < n:
+                # Connection dropped by _send.
+                n = len(order)
+                continue
+            i += 1
+        self._next = i
+        for conn_handle in order:
+            self._queues[conn_handle].stalled = False
+        return sent
+
+    # run() pumps every 10 ms.
+    _period_ms = 10
+    tick = pump
+
+    def _send(self, conn_handle, q, char_handle, data):
+        # True when sent, False when the stack is busy, None when the
+        # connection is gone (and removed).
+        try:
+            self._notify(conn_handle, char_handle, data)
+        except OSError as e:
+            if isBusy(e):
+                q.busy += 1
+                q.stalled = True
+                return False
+            self.remove(conn_handle)
+            return None
+        q.sent += 1
+        q.bytes += len(data)
+        return True
+
+    def depth(self, conn_handle):
+        q = self._queues.get(conn_handle)
+        return len(q.handles) if q else 0
+
+    def stats(self, conn_handle):
+        q = self._queues.get(conn_handle)
+        if q is None:
+            return None
+        ms = ticks_diff(ticks_ms(), q.start)
+        return {
+            "depth": len(q.handles),
+            "sent": q.sent,
+            "bytes": q.bytes,
+            "merged": q.merged,
+            "dropped": q.dropped,
+            "busy": q.busy,
+            "bps": q.bytes * 1000 // ms if ms > 0 else 0,
+        }
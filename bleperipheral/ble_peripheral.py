@@ -4,15 +4,64 @@ bleperipheral package
 '''
 import _thread
 from bleperipheral.util import bluetooth, micropython, uasyncio as asyncio, const
-from bleperipheral.util import isFunction, isGenerator, isBoundMethod
-from bleperipheral.ble_advertising import advertising_payload
+from bleperipheral.util import isFunction, isGenerator, isBoundMethod, TaskLauncher, ticks_ms, ticks_us, ticks_diff
+from bleperipheral.ble_advertising import AdvertisingPayload
+from bleperipheral.ble_gatt import GATTSchema
+from bleperipheral.ble_connection import ConnectionTable
+from bleperipheral.ble_events import EventRing, EventStream, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE
+
+try:
+    import machine
+except ImportError:
+    machine = None
 
 _IRQ_CENTRAL_CONNECT    = const(1)
 _IRQ_CENTRAL_DISCONNECT = const(2)
 _IRQ_GATTS_WRITE        = const(3)
+_IRQ_GATTS_READ_REQUEST = const(4)
+_IRQ_MTU_EXCHANGED      = const(21)
+_IRQ_CONNECTION_UPDATE  = const(27)
+
+_ADV_TYPE_SERVICE_DATA  = const(0x16)
+
+_FLAG_WRITE_NO_RESPONSE = const(0x0004)
+_FLAG_WRITE             = const(0x0008)
+
+_GATTS_NO_ERROR         = const(0x00)
+_GATTS_ERROR_UNLIKELY   = const(0x0E)
+
+_DEFAULT_BUFFER = const(20)
+_DEFAULT_MTU    = const(23)
+_ATT_HEADER     = const(3)
+_RETRY_MS       = const(10)
+
+# Metrics counter indices, as in ble_metrics (imported by metrics()).
+_M_IRQ           = const(0)
+_M_IRQ_CONNECT   = const(1)
+_M_SCHEDULE_FULL = const(5)
+_M_NOTIFY        = const(6)
+_M_NOTIFY_FAILED = const(7)
+_M_WRITE         = const(8)
+_M_ADVERTISE     = const(9)
 
 class BLEPeripheral:
-    def __init__(self, ble=None, multi_connections = 0, sender=None):
+    def __init__(self, ble=None, multi_connections = 0, sender=None, event_capacity=16, overflow=OVERFLOW_DROP_OLDEST):
+        '''
+        parameters
+        ----------
+            event_capacity:int
+                Number of IRQ events buffered until the scheduled drain runs.
+
+            overflow:int
+                OVERFLOW_DROP_OLDEST: a full buffer drops its oldest event.
+                OVERFLOW_COALESCE: while the buffer is full, a write is merged into
+                a pending write to the same handle, or replaces the oldest event, and
+                is read from the stack when dispatched. Until then writes are read
+                in the IRQ as with OVERFLOW_DROP_OLDEST.
+                See droppedEvents and coalescedEvents.
+        '''
+        self._created_us = ticks_us()
+        self._first_adv_us = None
         self._a_lock = _thread.allocate_lock()
         if sender:
             self._sender=sender
@@ -22,21 +71,49 @@ class BLEPeripheral:
             self._ble = ble
         else:
             self._ble = bluetooth.BLE()
-        self._connections = set()
+        self._connections = ConnectionTable(multi_connections + 1 if multi_connections >= 0 else 4)
         self._multi_connections = multi_connections
         self._auto_advertise = True
         self._advertising = False
+        self._adv = None
+        self._schema = None
+        self._definition = None
+        self._handles = ()
+        self._buffers = {}
+        self._zero_copy = False
         self._payload = None
+        self._resp_payload = None
+        self._interval_us = 500000
+        self._adv_dirty = False
+        self._adv_issued = ticks_ms()
+        self._adv_timer = None
+        self._refresh_ref = self._refresh
+        self._zc_buffers = {}
+        self._events = EventRing(event_capacity, overflow)
+        self._drain_scheduled = False
+        self._drain_ref = self._drain
+        self._stream = None
+        self._write_waiters = {}
+        self._write_handlers = {}
+        self._read_providers = {}
+        self._tasks = TaskLauncher()
+        self._notifier = None
+        self._metrics = None
+        self._drain_t = 0
+        # See addLinkHook().
+        self._link_hooks = []
         self.irq()
         self._ble.irq(self._irq)
         self._ble.active(True)
     
-    def build(self, services_definition, adv_services=None, adv_name="upy-ble", adv_service_data=None, adv_appearance=0, adv_payload=None):        
+    def build(self, services_definition, adv_services=None, adv_name="upy-ble", adv_service_data=None, adv_appearance=0, adv_payload=None, adv_resp=None, zero_copy=False):
         '''
         parameters
         ----------
-            services_definition:list
-            
+            services_definition:list,GATTSchema
+                A GATTSchema is bound to the registered handles and its
+                buffer sizes are applied with setBuffer.
+
             adv_services:set
 
             adv_name:str
@@ -45,7 +122,20 @@ class BLEPeripheral:
 
             adv_appearance:int
 
-            adv_payload:bytes
+            adv_payload:bytes,AdvertisingPayload
+                Precomputed advertising data, used instead of the adv_* values.
+
+            adv_resp:bytes
+                Precomputed scan response for a bytes adv_payload.
+
+            zero_copy:bool
+                Preallocate a buffer per writable characteristic (sized by setBuffer).
+                The write handler then receives a memoryview into that buffer,
+                valid until the next write to the same characteristic is dispatched.
+                Writes are read from the stack outside the IRQ, so consecutive
+                writes to one characteristic may be delivered as one.
+                Characteristics put in append mode by setBuffer are left out:
+                their writes are read in the IRQ, before the stack's buffer fills.
 
         remarks
         ----------
@@ -59,13 +149,120 @@ class BLEPeripheral:
             https://www.bluetooth.com/wp-content/uploads/Sitecore-Media-Library/Gatt/Xml/Characteristics/org.bluetooth.characteristic.gap.appearance.xml
     
         '''
-        if adv_payload:
-            self._payload = adv_payload
+        if isinstance(adv_payload, AdvertisingPayload):
+            self._adv = adv_payload
+        elif adv_payload:
+            self._adv = AdvertisingPayload(adv_payload, adv_resp)
         else:
-            self._payload = advertising_payload(
+            # Name, 128-bit UUIDs and service data move to the scan response when needed.
+            self._adv = AdvertisingPayload.create(
                 name=adv_name, services=adv_services, service_data=adv_service_data, appearance=adv_appearance
             )
-        return self._ble.gatts_register_services(services_definition)
+        self._payload = self._adv.adv
+        self._resp_payload = self._adv.resp
+        schema = None
+        if isinstance(services_definition, GATTSchema):
+            schema = services_definition
+            services_definition = schema.definition
+        handles = self._ble.gatts_register_services(services_definition)
+        self._definition = services_definition
+        self._handles = handles
+        self._buffers.clear()
+        self._zero_copy = zero_copy
+        self._zc_buffers.clear()
+        if zero_copy:
+            for service, service_handles in zip(services_definition, handles):
+                i = 0
+                for characteristic in service[1]:
+                    if characteristic[1] & (_FLAG_WRITE | _FLAG_WRITE_NO_RESPONSE):
+                        self._zc_alloc(service_handles[i], _DEFAULT_BUFFER)
+                    i += 1
+                    if len(characteristic) > 2:
+                        i += len(characteristic[2])
+        self._schema = schema
+        if schema:
+            schema.bind(handles)
+            for c in schema.characteristics.values():
+                if c.buffer_size:
+                    self.setBuffer(c.handle, c.buffer_size, c.append)
+                if c.on_write:
+                    self.onWrite(c.handle, c.on_write)
+                if c.on_read:
+                    self.onRead(c.handle, c.on_read, c.read_ttl_ms)
+        return handles
+
+    def restore(self, image, advertise=True, schema=None):
+        '''
+        build() from a BootImage (see ble_bootcache), skipping payload
+        construction, and start advertising with its interval.
+        The image's setBuffer sizes and zero_copy setting are applied.
+        Handlers (onWrite, onRead) are not part of the image: register them
+        again, or pass the GATTSchema the image was built from as schema so
+        it is bound as in build().
+
+        parameters
+        ----------
+            image:BootImage
+
+            advertise:bool
+
+            schema:GATTSchema
+                Registered instead of image.definition; it must declare the
+                same services (bump the cache tag when it changes).
+
+        returns
+        ----------
+            tuple
+                the registered handles, as from build()
+        '''
+        handles = self.build(
+            schema or image.definition, adv_payload=image.adv, adv_resp=image.resp, zero_copy=image.zero_copy
+        )
+        if image.buffers:
+            flat = [h for service_handles in handles for h in service_handles]
+            for index, length, append in image.buffers:
+                self.setBuffer(flat[index], length, append)
+        if advertise:
+            self.advertise(image.interval_us)
+        return handles
+
+    def buildSettings(self):
+        '''
+        What restore() needs to repeat the last build(); see
+        ble_bootcache.image().
+
+        returns
+        ----------
+            tuple
+                (definition, adv, resp, interval_us, buffers, zero_copy),
+                buffers holding (index, length, append) per setBuffer call,
+                index counting the handles returned by build() across all
+                services.
+        '''
+        flat = [h for service_handles in self._handles for h in service_handles]
+        buffers = tuple(
+            (flat.index(value_handle), length, append)
+            for value_handle, (length, append) in sorted(self._buffers.items())
+        )
+        return (self._definition, self._payload, self._resp_payload, self._interval_us, buffers, self._zero_copy)
+
+    def handle(self, name):
+        '''
+        Handle of a characteristic or descriptor declared in a GATTSchema.
+        '''
+        return self._schema.handles[name]
+
+    def characteristic(self, value_handle):
+        '''
+        Characteristic of a GATTSchema registered under value_handle, or None.
+        '''
+        return self._schema.characteristics.get(value_handle) if self._schema else None
+
+    def _zc_alloc(self, value_handle, length):
+        buf = self._zc_buffers.get(value_handle)
+        if buf is None or len(buf[0]) < length:
+            b = bytearray(length)
+            self._zc_buffers[value_handle] = (b, memoryview(b))
 
     def irq(self, handlerCentralConnect=None, handlerCentralDisconnect=None, handlerGattsWrite=None, handlerUnhandled=None):
         '''
@@ -89,164 +286,705 @@ class BLEPeripheral:
             
         '''
         if isFunction(handlerCentralConnect):
-            def cb11(arg):
-                (conn_handle,)=arg
+            def on11(conn_handle):
                 handlerCentralConnect(self._sender, conn_handle)
-            self._cb_on_central_connect=cb11
+            self._on_central_connect=on11
         elif isGenerator(handlerCentralConnect):
-            def cb12(arg):
-                (conn_handle,)=arg
-                coro = handlerCentralConnect(self._sender, conn_handle)
-                loop = asyncio.get_event_loop()
-                loop.create_task(coro)
-            self._cb_on_central_connect=cb12
+            def on12(conn_handle):
+                self._await(handlerCentralConnect(self._sender, conn_handle))
+            self._on_central_connect=on12
         elif isBoundMethod(handlerCentralConnect):
-            def cb13(arg):
-                (conn_handle,)=arg
-                handlerCentralConnect(conn_handle)
-            self._cb_on_central_connect=cb13
+            self._on_central_connect=handlerCentralConnect
         else:
-            self._cb_on_central_connect=None
+            self._on_central_connect=None
 
         if isFunction(handlerCentralDisconnect):
-            def cb21(arg):
-                (conn_handle,)=arg
+            def on21(conn_handle):
                 handlerCentralDisconnect(self._sender, conn_handle)
-            self._cb_on_central_disconnect=cb21
+            self._on_central_disconnect=on21
         elif isGenerator(handlerCentralDisconnect):
-            def cb22(arg):
-                (conn_handle,)=arg
-                coro = handlerCentralDisconnect(self._sender, conn_handle)
-                loop = asyncio.get_event_loop()
-                loop.create_task(coro)
-            self._cb_on_central_disconnect=cb22
+            def on22(conn_handle):
+                self._await(handlerCentralDisconnect(self._sender, conn_handle))
+            self._on_central_disconnect=on22
         elif isBoundMethod(handlerCentralDisconnect):
-            def cb23(arg):
-                (conn_handle,)=arg
-                handlerCentralDisconnect(conn_handle)
-            self._cb_on_central_disconnect=cb23
-        else:
-            self._cb_on_central_disconnect=None
-
-        if isFunction(handlerGattsWrite):
-            def cb31(arg):
-                (conn_handle, value_handler, value,)=arg
-                handlerGattsWrite(self._sender, conn_handle, value_handler, value)
-            self._cb_on_gatts_write=cb31
-        elif isGenerator(handlerGattsWrite):
-            def cb32(arg):
-                (conn_handle, value_handler, value,)=arg
-                coro = handlerGattsWrite(self._sender, conn_handle, value_handler, value)
-                loop = asyncio.get_event_loop()
-                loop.create_task(coro)
-            self._cb_on_gatts_write=cb32
-        elif isBoundMethod(handlerGattsWrite):
-            def cb33(arg):
-                (conn_handle, value_handler, value,)=arg
-                handlerGattsWrite(conn_handle, value_handler, value)
-            self._cb_on_gatts_write=cb33
+            self._on_central_disconnect=handlerCentralDisconnect
         else:
-            self._cb_on_gatts_write=None
+            self._on_central_disconnect=None
+
+        self._on_gatts_write=self._writeHandler(handlerGattsWrite)
 
         if isFunction(handlerUnhandled):
-            def cb01(arg):
-                (event, data,)=arg
+            def on01(event, data):
                 handlerUnhandled(self._sender, event, data)
-            self._cb_on_unhandled=cb01
+            self._on_unhandled=on01
         elif isGenerator(handlerUnhandled):
-            def cb02(arg):
-                (event, data,)=arg
-                coro = handlerUnhandled(self._sender, event, data)
-                loop = asyncio.get_event_loop()
-                loop.create_task(coro)
-            self._cb_on_unhandled=cb02
+            def on02(event, data):
+                self._await(handlerUnhandled(self._sender, event, data))
+            self._on_unhandled=on02
         elif isBoundMethod(handlerUnhandled):
-            def cb03(arg):
-                (event, data,)=arg
-                handlerUnhandled(event, data)
-            self._cb_on_unhandled=cb03
+            self._on_unhandled=handlerUnhandled
         else:
-            def cb04(arg):
-                pass
-            self._cb_on_unhandled=cb04
-
-    def _irq_on_central_connect(self, conn_handle):
-        if self._cb_on_central_connect:
-            micropython.schedule(self._cb_on_central_connect, (conn_handle,))
-            return True
-        else:
-            return False
+            self._on_unhandled=None
 
-    def _irq_on_central_disconnect(self, conn_handle):
-        if self._cb_on_central_disconnect:
-            micropython.schedule(self._cb_on_central_disconnect, (conn_handle,))
-            return True
+    def _writeHandler(self, handler):
+        if isFunction(handler):
+            def on31(conn_handle, value_handle, value):
+                handler(self._sender, conn_handle, value_handle, value)
+            return on31
+        elif isGenerator(handler):
+            def on32(conn_handle, value_handle, value):
+                if type(value) is memoryview:
+                    value = bytes(value)
+                self._await(handler(self._sender, conn_handle, value_handle, value))
+            return on32
+        elif isBoundMethod(handler):
+            return handler
         else:
-            return False
+            return None
 
-    def _irq_on_gatts_write(self, conn_handle, value_handle, value):
-        if self._cb_on_gatts_write:
-            micropython.schedule(self._cb_on_gatts_write, (conn_handle, value_handle, value,))
-            return True
+    def onWrite(self, value_handle, handler):
+        '''
+        Registers a write handler for one value handle; None removes it.
+        It takes precedence over irq(handlerGattsWrite=...). Writes to a
+        handle nobody listens to are dropped in the IRQ, before gatts_read.
+
+        parameters
+        ----------
+            value_handle:int
+
+            handler:Function,Generator,BoundMethod,None
+                <method>(self/sender, conn_handle, value_handle, value)
+        '''
+        on = self._writeHandler(handler)
+        if on:
+            self._write_handlers[value_handle] = on
         else:
-            return False
+            self._write_handlers.pop(value_handle, None)
+
+    def onRead(self, value_handle, provider, ttl_ms=0, codec=None):
+        '''
+        Serves value_handle on demand: when a central reads it, provider is
+        called in the IRQ and its value is encoded (codec, by default the
+        GATTSchema characteristic's) and written before the read completes.
+        Reads within ttl_ms of the last evaluation get that value again.
+
+        The stack raises _IRQ_GATTS_READ_REQUEST only for characteristics
+        flagged read-authorized (0x0200, set by GATTSchema for on_read) on
+        ports that support it; elsewhere centrals read the last written value.
+
+        parameters
+        ----------
+            value_handle:int
+
+            provider:Function,BoundMethod,None
+                <method>(conn_handle, value_handle) -> value
+                Runs in the IRQ: keep it short. None removes it.
+
+            ttl_ms:int
+
+            codec:object,None
+                encode(value) -> bytes; without one provider returns bytes.
+        '''
+        if provider is None:
+            self._read_providers.pop(value_handle, None)
+            return
+        if codec is None:
+            c = self.characteristic(value_handle)
+            codec = c.codec if c else None
+        # [provider, codec, ttl_ms, evaluated at, evaluated]
+        self._read_providers[value_handle] = [provider, codec, ttl_ms, 0, False]
 
-    def _irq_on_unhandled(self, event, data):
-        micropython.schedule(self._cb_on_unhandled, (event, data,))
+    def _on_read_request(self, conn_handle, value_handle):
+        entry = self._read_providers.get(value_handle)
+        if entry is None:
+            return _GATTS_NO_ERROR
+        now = ticks_ms()
+        if entry[4] and entry[2] and ticks_diff(now, entry[3]) < entry[2]:
+            return _GATTS_NO_ERROR
+        try:
+            value = entry[0](conn_handle, value_handle)
+            self._ble.gatts_write(value_handle, entry[1].encode(value) if entry[1] else value)
+        except Exception:
+            entry[4] = False
+            return _GATTS_ERROR_UNLIKELY
+        entry[3] = now
+        entry[4] = True
+        return _GATTS_NO_ERROR
+
+    def _push(self, event, conn_handle, value_handle, data, coalesce=False):
+        # IRQ context: one ring slot per event and at most one scheduled drain.
+        self._events.push(event, conn_handle, value_handle, data, coalesce)
+        if not self._drain_scheduled:
+            self._schedule_drain()
+
+    def _schedule_drain(self):
+        try:
+            micropython.schedule(self._drain_ref, None)
+            self._drain_scheduled = True
+            if self._metrics:
+                self._drain_t = ticks_us()
+        except RuntimeError:
+            # Queue full; the events stay in the ring and the next IRQ retries.
+            if self._metrics:
+                self._metrics.counters[_M_SCHEDULE_FULL] += 1
+
+    def _resume_drain(self):
+        if len(self._events) and not self._drain_scheduled:
+            self._schedule_drain()
+
+    def _drain(self, _):
+        self._drain_scheduled = False
+        if self._metrics:
+            self._metrics.observe(self._metrics.latency_us, ticks_diff(ticks_us(), self._drain_t))
+        events = self._events
+        try:
+            while len(events):
+                i = events.peek()
+                event = events.event(i)
+                conn_handle = events.conn(i)
+                value_handle = events.handle(i)
+                data = events.data(i)
+                events.pop()
+                self._dispatch(event, conn_handle, value_handle, data)
+        finally:
+            # A handler raised: the rest is dispatched by another drain.
+            self._resume_drain()
+
+    def _dispatch(self, event, conn_handle, value_handle, data):
+        if event == _IRQ_CENTRAL_CONNECT:
+            if self._on_central_connect:
+                self._on_central_connect(conn_handle)
+            elif self._on_unhandled:
+                self._on_unhandled(event, data)
+        elif event == _IRQ_CENTRAL_DISCONNECT:
+            if self._on_central_disconnect:
+                self._on_central_disconnect(conn_handle)
+            elif self._on_unhandled:
+                self._on_unhandled(event, data)
+        elif event == _IRQ_GATTS_WRITE:
+            if data is None:
+                data = self._read_value(value_handle)
+            c = self._connections.get(conn_handle)
+            if c:
+                c.rx_bytes += len(data)
+            on = self._write_handlers.get(value_handle) or self._on_gatts_write
+            if on:
+                on(conn_handle, value_handle, data)
+            elif self._on_unhandled:
+                self._on_unhandled(event, (conn_handle, value_handle,))
+            if self._write_waiters or self._stream:
+                if type(data) is memoryview:
+                    # Async consumers run after the buffer has been reused.
+                    data = bytes(data)
+                waiter = self._write_waiters.get(value_handle)
+                if waiter:
+                    waiter[1] = data
+                    waiter[0].set()
+        elif self._on_unhandled:
+            self._on_unhandled(event, data)
+        if self._stream:
+            self._stream.put(event, conn_handle, value_handle, data)
+
+    def _await(self, coro):
+        # Every coroutine handler runs as its own task.
+        self._tasks.start(coro)
+
+    def events(self):
+        '''
+        returns
+        ----------
+            EventStream
+                async for event, conn_handle, value_handle, value in peripheral.events():
+
+                Events arrive in IRQ order after the registered irq() handlers
+                have run. A slow consumer never holds those handlers back:
+                when the stream is full its oldest event is dropped and
+                counted in EventStream.dropped. EventStream.close() detaches it.
+        '''
+        if not self._stream:
+            self._stream = EventStream(self._events.capacity, self._detach_stream)
+        return self._stream
+
+    def _detach_stream(self):
+        self._stream = None
+
+    async def wait_write(self, value_handle):
+        '''
+        Waits for the next write to value_handle and returns the value.
+        Writes made while nobody waits keep only the latest value.
+        '''
+        waiter = self._write_waiters.get(value_handle)
+        if waiter is None:
+            waiter = [asyncio.ThreadSafeFlag(), None]
+            self._write_waiters[value_handle] = waiter
+        await waiter[0].wait()
+        value = waiter[1]
+        waiter[1] = None
+        return value
+
+    def _read_value(self, value_handle):
+        data = self._ble.gatts_read(value_handle)
+        zc = self._zc_buffers.get(value_handle)
+        if zc is None:
+            return data
+        buf, mv = zc
+        n = len(data)
+        if n > len(buf):
+            n = len(buf)
+            data = data[0:n]
+        mv[0:n] = data
+        return mv[0:n]
+
+    def _irq_metered(self, event, data):
+        t = ticks_us()
+        counters = self._metrics.counters
+        counters[_M_IRQ] += 1
+        if event <= _IRQ_GATTS_READ_REQUEST:
+            # IRQ_CONNECT .. IRQ_READ follow the event numbers.
+            counters[_M_IRQ_CONNECT + event - _IRQ_CENTRAL_CONNECT] += 1
+        result = self._irq(event, data)
+        self._metrics.observe(self._metrics.irq_us, ticks_diff(ticks_us(), t))
+        return result
 
     def _irq(self, event, data):
-        handled = False
         if event == _IRQ_CENTRAL_CONNECT:
-            conn_handle, _, _, = data
+            conn_handle, addr_type, addr, = data
             with self._a_lock:
-                self._connections.add(conn_handle)
+                self._connections.open(conn_handle, addr_type, addr)
+                for hook in self._link_hooks:
+                    hook(conn_handle, True)
                 self._advertising = False
                 if self._auto_advertise:
-                    self.advertise()
-            handled=self._irq_on_central_connect(conn_handle)
+                    self.advertise(self._interval_us)
+            if self._on_central_connect or self._on_unhandled or self._stream:
+                # addr is only valid during the IRQ.
+                self._push(event, conn_handle, 0, (conn_handle, addr_type, bytes(addr)))
         elif event == _IRQ_CENTRAL_DISCONNECT:
-            conn_handle, _, _, = data
+            conn_handle, addr_type, addr, = data
             with self._a_lock:
-                if conn_handle in self._connections:
-                    self._connections.remove(conn_handle)
+                self._connections.close(conn_handle)
+                if self._notifier:
+                    self._notifier.remove(conn_handle)
+                for hook in self._link_hooks:
+                    hook(conn_handle, False)
                 if self._auto_advertise:
-                    self.advertise()
-            handled=self._irq_on_central_disconnect(conn_handle)
+                    self.advertise(self._interval_us)
+            if self._on_central_disconnect or self._on_unhandled or self._stream:
+                self._push(event, conn_handle, 0, (conn_handle, addr_type, bytes(addr)))
         elif event == _IRQ_GATTS_WRITE:
             conn_handle, value_handle, = data
-            value = self._ble.gatts_read(value_handle)
-            handled=self._irq_on_gatts_write(conn_handle, value_handle, value)
-        if not handled:
-            self._irq_on_unhandled(event, data)
+            c = self._connections.get(conn_handle)
+            if c:
+                c.writes += 1
+            if value_handle in self._write_handlers or self._on_gatts_write or self._on_unhandled \
+                    or self._stream or value_handle in self._write_waiters:
+                if value_handle in self._zc_buffers:
+                    # Read into the preallocated buffer when dispatched.
+                    self._push(event, conn_handle, value_handle, None, True)
+                elif self._events.overflow == OVERFLOW_COALESCE and self._events.full():
+                    # Read when dispatched, the latest value for merged writes.
+                    self._push(event, conn_handle, value_handle, None)
+                else:
+                    self._push(event, conn_handle, value_handle, self._ble.gatts_read(value_handle))
+        elif event == _IRQ_GATTS_READ_REQUEST:
+            conn_handle, value_handle, = data
+            result = self._on_read_request(conn_handle, value_handle)
+            if self._on_unhandled or self._stream:
+                self._push(event, 0, 0, data)
+            return result
+        else:
+            if event == _IRQ_MTU_EXCHANGED:
+                conn_handle, mtu, = data
+                c = self._connections.get(conn_handle)
+                if c:
+                    c.mtu = mtu
+            elif event == _IRQ_CONNECTION_UPDATE:
+                conn_handle, interval, latency, timeout, status, = data
+                c = self._connections.get(conn_handle)
+                if c and status == 0:
+                    c.interval = interval
+                    c.latency = latency
+                    c.timeout = timeout
+            if self._on_unhandled or self._stream:
+                self._push(event, 0, 0, data)
 
     def advertise(self, interval_us=500000, auto_advertise=True):
         self._auto_advertise = auto_advertise
-        if not self._advertising and (self._multi_connections<0 or len(self._connections)<=self._multi_connections):
-            self._ble.gap_advertise(interval_us, adv_data=self._payload)
+        self._interval_us = interval_us
+        if not self._advertising and self.canAdvertise():
+            self._gap_advertise()
             self._advertising = True
 
+    def setAdvertising(self, payload=None, interval_us=None):
+        '''
+        Switches the advertising payload and/or interval and re-issues
+        advertising at once, unless the connection limit is reached.
+
+        parameters
+        ----------
+            payload:AdvertisingPayload,None
+
+            interval_us:int,None
+
+        returns
+        ----------
+            bool
+                True when advertising was issued.
+        '''
+        if payload is not None:
+            self._adv = payload
+            self._payload = payload.adv
+            self._resp_payload = payload.resp
+        if interval_us is not None:
+            self._interval_us = interval_us
+        if not self.canAdvertise():
+            return False
+        self._gap_advertise()
+        self._advertising = True
+        return True
+
+    def stopAdvertising(self):
+        self._ble.gap_advertise(None)
+        self._advertising = False
+
+    def canAdvertise(self):
+        # False while multi_connections centrals are connected.
+        return self._multi_connections < 0 or len(self._connections) <= self._multi_connections
+
+    @property
+    def advertising(self):
+        return self._advertising
+
+    @property
+    def advertisingPayload(self):
+        # AdvertisingPayload being advertised.
+        return self._adv
+
+    @property
+    def autoAdvertise(self):
+        # Re-advertise on connect and disconnect (see advertise()).
+        return self._auto_advertise
+
+    @autoAdvertise.setter
+    def autoAdvertise(self, value):
+        self._auto_advertise = value
+
+    def _gap_advertise(self):
+        self._ble.gap_advertise(self._interval_us, adv_data=self._payload, resp_data=self._resp_payload)
+        if self._first_adv_us is None and self._interval_us:
+            self._first_adv_us = ticks_diff(ticks_us(), self._created_us)
+        if self._metrics:
+            self._metrics.counters[_M_ADVERTISE] += 1
+        self._adv_dirty = False
+        self._adv_issued = ticks_ms()
+
+    def update_service_data(self, data, min_interval_ms=100):
+        '''
+        Patches the advertised service data in place. data must have the
+        same length as the adv_service_data given to build().
+
+        The stack keeps its own copy of the payload, so advertising is
+        re-issued, at most once per min_interval_ms. A change inside that
+        interval is sent when the interval expires, from a one-shot
+        machine.Timer; on ports without one, by the next update_service_data()
+        or refreshAdvertising().
+
+        returns
+        ----------
+            bool
+                True when the new data went to the radio.
+        '''
+        field = self._adv.field(_ADV_TYPE_SERVICE_DATA) if self._adv else None
+        if not field:
+            raise ValueError("no service data")
+        in_resp, offset, length = field
+        if len(data) != length:
+            raise ValueError("service data length")
+        view = self._resp_payload if in_resp else self._payload
+        changed = False
+        for i in range(length):
+            if view[offset + i] != data[i]:
+                changed = True
+                break
+        if changed:
+            view[offset:offset + length] = data
+            self._adv_dirty = True
+        return self.refreshAdvertising(min_interval_ms)
+
+    def refreshAdvertising(self, min_interval_ms=0):
+        '''
+        Re-issues advertising if the payload changed since it was last sent.
+        Within min_interval_ms of the last time, it is re-issued when the
+        interval expires instead (where the port has machine.Timer).
+        '''
+        if not (self._adv_dirty and self._advertising):
+            return False
+        wait = min_interval_ms - ticks_diff(ticks_ms(), self._adv_issued)
+        if wait > 0:
+            self._arm_refresh(wait)
+            return False
+        self._gap_advertise()
+        return True
+
+    def _arm_refresh(self, ms):
+        if not (machine and hasattr(machine, "Timer")):
+            return
+        if self._adv_timer is None:
+            self._adv_timer = machine.Timer(-1)
+        self._adv_timer.init(mode=machine.Timer.ONE_SHOT, period=ms, callback=self._on_refresh_timer)
+
+    def _on_refresh_timer(self, _timer):
+        # Possibly a hard IRQ: advertise from the scheduler.
+        try:
+            micropython.schedule(self._refresh_ref, None)
+        except RuntimeError:
+            self._arm_refresh(_RETRY_MS)
+
+    def _refresh(self, _):
+        self.refreshAdvertising()
+
+    def mtu(self, conn_handle):
+        '''
+        ATT MTU negotiated with conn_handle (23 until an exchange completes).
+        '''
+        c = self._connections.get(conn_handle)
+        return c.mtu if c else _DEFAULT_MTU
+
+    def maxPayload(self, conn_handle=None):
+        '''
+        Largest notification/write value for conn_handle (mtu - 3).
+        Without conn_handle, the smallest over all connections.
+        '''
+        if conn_handle is not None:
+            return self.mtu(conn_handle) - _ATT_HEADER
+        mtu = 0
+        for c in self._connections.records():
+            if not mtu or c.mtu < mtu:
+                mtu = c.mtu
+        return (mtu or _DEFAULT_MTU) - _ATT_HEADER
+
+    def requestMtu(self, mtu=247, conn_handle=None):
+        '''
+        Sets the preferred MTU and starts an exchange with conn_handle
+        (every connection when None). The result arrives as _IRQ_MTU_EXCHANGED.
+        '''
+        self._ble.config(mtu=mtu)
+        if conn_handle is not None:
+            self._ble.gattc_exchange_mtu(conn_handle)
+        else:
+            for conn_handle in self._connections.handles():
+                self._ble.gattc_exchange_mtu(conn_handle)
+
     def setBuffer(self, value_handle, length, append=False):
         self._ble.gatts_set_buffer(value_handle, length, append)
+        self._buffers[value_handle] = (length, append)
+        if value_handle in self._zc_buffers:
+            if append:
+                # Deferred reads would let appended writes overflow the stack's buffer.
+                del self._zc_buffers[value_handle]
+            else:
+                self._zc_alloc(value_handle, length)
     
     def write(self, char_handle, data, notify=False):
         self._ble.gatts_write(char_handle, data)
+        if self._metrics:
+            self._metrics.counters[_M_WRITE] += 1
         if notify:
-            for conn_handle in self._connections:
-                self._ble.gatts_notify(conn_handle, char_handle)
+            if self._notifier:
+                self._notifier.notify(self._connections, char_handle, data)
+                self._notifier.pump()
+            else:
+                self._notify(char_handle, data)
+
+    def writeValue(self, char_handle, value, notify=False, codec=None, force=False):
+        '''
+        Encodes value with codec (default: the GATTSchema characteristic's)
+        and writes it; an unchanged encoding is neither written nor notified.
+
+        returns
+        ----------
+            bool
+                True when the value was written.
+        '''
+        if codec is None:
+            codec = self.characteristic(char_handle).codec
+        if force:
+            data = codec.encode(value)
+        else:
+            data = codec.update(value)
+            if data is None:
+                return False
+        self.write(char_handle, data, notify)
+        return True
 
     def notify(self, char_handle, data):
+        if self._notifier:
+            self._notifier.notify(self._connections, char_handle, data)
+            self._notifier.pump()
+        else:
+            self._notify(char_handle, data)
+
+    def _notify(self, char_handle, data):
         for conn_handle in self._connections:
-            self._ble.gatts_notify(conn_handle, char_handle, data)
-    
+            self.gattsNotify(conn_handle, char_handle, data)
+
+    def gattsNotify(self, conn_handle, char_handle, data=None):
+        '''
+        One notification to one connection, counted in its Connection
+        (notifies, tx_bytes) and in metrics(). Everything in this package
+        that notifies goes through here.
+
+        Raises OSError like gatts_notify; see util.isBusy().
+        '''
+        m = self._metrics
+        try:
+            if data is None:
+                self._ble.gatts_notify(conn_handle, char_handle)
+            else:
+                self._ble.gatts_notify(conn_handle, char_handle, data)
+        except OSError:
+            if m:
+                m.counters[_M_NOTIFY_FAILED] += 1
+            raise
+        c = self._connections.get(conn_handle)
+        if c:
+            c.notifies += 1
+            if data is not None:
+                c.tx_bytes += len(data)
+        if m:
+            m.counters[_M_NOTIFY] += 1
+
+    def traffic(self, conn_handle):
+        '''
+        returns
+        ----------
+            int
+                writes received plus notifications sent through gattsNotify()
+                on conn_handle, 0 when not connected.
+        '''
+        c = self._connections.get(conn_handle)
+        return c.writes + c.notifies if c else 0
+
+    def notifier(self, max_pending=8, latest=()):
+        '''
+        Routes notify() and write(..., notify=True) through a NotifyScheduler.
+        What the stack cannot take now stays queued per connection until the
+        next notify(), NotifyScheduler.pump() or NotifyScheduler.run().
+
+        parameters
+        ----------
+            max_pending:int
+
+            latest:tuple
+                characteristic handles whose queued value may be replaced by
+                a newer one, see NotifyScheduler.latest(). Every other
+                notification is sent in order.
+
+        returns
+        ----------
+            NotifyScheduler
+        '''
+        if not self._notifier:
+            from bleperipheral.ble_notify import NotifyScheduler
+            self._notifier = NotifyScheduler(self, max_pending)
+        for char_handle in latest:
+            self._notifier.latest(char_handle)
+        return self._notifier
+
+    @property
+    def notifyScheduler(self):
+        '''
+        The NotifyScheduler set up by notifier(), or None.
+        '''
+        return self._notifier
+
+    def connection(self, conn_handle):
+        '''
+        returns
+        ----------
+            Connection,None
+                a copy of the record of conn_handle, None when not connected.
+        '''
+        c = self._connections.get(conn_handle)
+        return c.copy() if c else None
+
+    def connections(self):
+        '''
+        returns
+        ----------
+            tuple
+                conn_handles of the current connections
+        '''
+        return self._connections.handles()
+
+    def metrics(self):
+        '''
+        Starts collecting Metrics (IRQ counts and durations, IRQ to drain
+        latency, notifies, writes, advertising) and returns them.
+
+        returns
+        ----------
+            Metrics
+        '''
+        if not self._metrics:
+            from bleperipheral.ble_metrics import Metrics
+            self._metrics = Metrics()
+            self._metrics._peripheral = self
+            self._ble.irq(self._irq_metered)
+        return self._metrics
+
+    @property
+    def timeToAdvertise(self):
+        '''
+        Microseconds from creating this BLEPeripheral to its first
+        advertisement, None until then. ticks_ms() at that point is the
+        time since boot.
+        '''
+        return self._first_adv_us
+
+    @property
+    def ble(self):
+        # The bluetooth.BLE object, for what BLEPeripheral does not wrap.
+        return self._ble
+
+    def addLinkHook(self, hook):
+        '''
+        Calls hook(conn_handle, connected) on every connect and disconnect.
+
+        It runs in the IRQ, before the connection's events are queued: do
+        not allocate there, record what happened and defer the work to
+        micropython.schedule, a ThreadSafeFlag or the next write.
+        '''
+        if hook not in self._link_hooks:
+            self._link_hooks.append(hook)
+
+    def removeLinkHook(self, hook):
+        if hook in self._link_hooks:
+            self._link_hooks.remove(hook)
+
     def isConnected(self):
         return self.connectionCount>0
     
     @property
     def connectionCount(self):
         return len(self._connections)
+
+    @property
+    def pendingEvents(self):
+        return len(self._events)
+
+    @property
+    def droppedEvents(self):
+        return self._events.dropped
+
+    @property
+    def coalescedEvents(self):
+        return self._events.coalesced
     
     def close(self):
+        if self._adv_timer:
+            self._adv_timer.deinit()
         with self._a_lock:
-            for conn_handle in self._connections:
+            for conn_handle in self._connections.handles():
                 self._ble.gap_disconnect(conn_handle)
             self._connections.clear()
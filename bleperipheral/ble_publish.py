@@ -0,0 +1,147 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import Periodic, isBusy, ticks_ms, ticks_diff
+
+
+class _Channel:
+    def __init__(self, char_handle, codec, deadband, min_interval_ms, max_interval_ms):
+        self.handle = char_handle
+        self.codec = codec
+        self.deadband = deadband
+        self.min_ms = min_interval_ms
+        self.max_ms = max_interval_ms
+        self.value = None
+        self.data = None
+        self.sent = None
+        self.pending = False
+        self.due = False
+        self.send = False
+        self.last = ticks_ms()
+        self.notified = 0
+        self.suppressed = 0
+
+
+class Publisher(Periodic):
+    '''
+    Notify-on-change publishing for sensor characteristics.
+
+    publish() only records the latest value. tick() writes changed values
+    to the local GATT database and notifies a characteristic when
+
+        - its value moved more than deadband from the last notified value
+          and min_interval_ms has passed since the last notification, or
+        - max_interval_ms (0: never) has passed since the last notification.
+
+    All characteristics due in one tick() are written first and then
+    notified together; with a NotifyScheduler attached they are queued and
+    pumped once, and a value still queued is replaced by the next one.
+    '''
+
+    def __init__(self, peripheral):
+        self._peripheral = peripheral
+        self._channels = {}
+
+    def add(self, char_handle, codec=None, deadband=0, min_interval_ms=0, max_interval_ms=0):
+        '''
+        parameters
+        ----------
+            char_handle:int
+
+            codec:object,None
+                see BLEPeripheral.writeValue; the GATTSchema characteristic's
+                codec when None. Without any codec values are bytes.
+
+            deadband:int,float
+                ignored for non-numeric values.
+
+            min_interval_ms:int
+
+            max_interval_ms:int
+        '''
+        if codec is None:
+            c = self._peripheral.characteristic(char_handle)
+            codec = c.codec if c else None
+        self._channels[char_handle] = _Channel(char_handle, codec, deadband, min_interval_ms, max_interval_ms)
+
+    def remove(self, char_handle):
+        self._channels.pop(char_handle, None)
+
+    def publish(self, char_handle, value):
+        ch = self._channels[char_handle]
+        ch.value = value
+        ch.pending = True
+
+    def _changed(self, ch):
+        if ch.sent is None:
+            return True
+        if ch.deadband and isinstance(ch.value, (int, float)):
+            return abs(ch.value - ch.sent) > ch.deadband
+        return ch.value != ch.sent
+
+    def tick(self):
+        '''
+        returns
+        ----------
+            int
+                number of characteristics notified
+        '''
+        p = self._peripheral
+        now = ticks_ms()
+        due = 0
+        for ch in self._channels.values():
+            if ch.pending:
+                ch.pending = False
+                data = ch.codec.update(ch.value) if ch.codec else ch.value
+                if data is not None:
+                    p.write(ch.handle, data)
+                    ch.data = data
+                if self._changed(ch):
+                    ch.due = True
+                else:
+                    ch.suppressed += 1
+            ch.send = False
+            if ch.data is None:
+                continue
+            elapsed = ticks_diff(now, ch.last)
+            if (ch.due and elapsed >= ch.min_ms) or (ch.max_ms and elapsed >= ch.max_ms):
+                ch.send = True
+                due += 1
+        if not due or not p.isConnected():
+            return 0
+        notifier = p.notifyScheduler
+        notified = 0
+        for ch in self._channels.values():
+            if not ch.send:
+                continue
+            try:
+                if notifier:
+                    notifier.latest(ch.handle)
+                    notifier.notify(p.connections(), ch.handle, ch.data)
+                else:
+                    for conn_handle in p.connections():
+                        p.gattsNotify(conn_handle, ch.handle, ch.data)
+            except OSError as e:
+                if not isBusy(e):
+                    raise
+                # Still due: the next tick retries.
+                continue
+            ch.due = ch.send = False
+            ch.sent = ch.value
+            ch.last = now
+            ch.notified += 1
+            notified += 1
+        if notifier:
+            notifier.pump()
+        return notified
+
+    def stats(self, char_handle):
+        '''
+        returns
+        ----------
+            tuple
+                (notified, suppressed)
+        '''
+        ch = self._channels[char_handle]
+        return (ch.notified, ch.suppressed)
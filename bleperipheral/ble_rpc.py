@@ -0,0 +1,220 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+import struct
+from bleperipheral.util import uasyncio as asyncio, const, isGenerator, isBusy, TaskLauncher
+
+
+_HEADER = const(4)
+
+STATUS_OK        = const(0)
+STATUS_UNKNOWN   = const(1)
+STATUS_BUSY      = const(2)
+STATUS_ERROR     = const(3)
+STATUS_TOO_LARGE = const(4)
+
+
+class _Link:
+    def __init__(self, conn_handle, size):
+        self.conn_handle = conn_handle
+        self.rx = bytearray(size)
+        self.rx_mv = memoryview(self.rx)
+        self.fill = 0
+        self.length = 0
+        # Payload bytes of a rejected frame still to come.
+        self.skip = 0
+        self.inflight = 0
+        self.out = []
+        self.out_pos = 0
+        self.flushing = False
+
+
+class RPCServer:
+    '''
+    Length-prefixed binary RPC over a pair of characteristics: centrals
+    write requests to rx_handle and get responses as notifications on
+    tx_handle.
+
+    frame
+    ----------
+        request:  <length:uint16 LE> <req_id:uint8> <method:uint8> <payload>
+        response: <length:uint16 LE> <req_id:uint8> <status:uint8> <payload>
+
+        length counts the payload only. Frames may span several writes
+        and notifications, and one write may carry several frames.
+        status is one of STATUS_OK, STATUS_UNKNOWN, STATUS_BUSY,
+        STATUS_ERROR or STATUS_TOO_LARGE.
+
+    Frames are reassembled in a preallocated buffer per connection.
+    A plain function handler(conn_handle, payload) runs as soon as its
+    frame is complete and gets a memoryview into that buffer, valid during
+    the call. An async handler gets a copy and runs as its own task, so up
+    to max_inflight requests per connection are in flight at once and
+    responses may come back out of order (match them by req_id).
+    '''
+
+    def __init__(self, peripheral, rx_handle, tx_handle, max_frame=512, max_inflight=4, retry_ms=5):
+        self._peripheral = peripheral
+        self._rx_handle = rx_handle
+        self._tx_handle = tx_handle
+        self._max_frame = max_frame
+        self._max_inflight = max_inflight
+        self._retry_ms = retry_ms
+        self._methods = {}
+        self._links = {}
+        self._tx = bytearray(_HEADER + max_frame)
+        self._tx_mv = memoryview(self._tx)
+        self._tasks = TaskLauncher()
+        self._link_ref = self._on_link
+        peripheral.addLinkHook(self._link_ref)
+        peripheral.onWrite(rx_handle, self._on_write)
+
+    def register(self, method_id, handler):
+        '''
+        parameters
+        ----------
+            method_id:int
+                0-255
+
+            handler:Function,Generator,None
+                <method>(conn_handle, payload) -> bytes-like or None
+                None removes the method.
+        '''
+        if handler is None:
+            self._methods.pop(method_id, None)
+        else:
+            self._methods[method_id] = handler
+
+    def method(self, method_id):
+        # Decorator form of register().
+        def _register(handler):
+            self.register(method_id, handler)
+            return handler
+        return _register
+
+    def _on_link(self, conn_handle, connected):
+        if not connected:
+            self._links.pop(conn_handle, None)
+
+    def _on_write(self, conn_handle, value_handle, data):
+        link = self._links.get(conn_handle)
+        if link is None:
+            link = _Link(conn_handle, _HEADER + self._max_frame)
+            self._links[conn_handle] = link
+        mv = memoryview(data)
+        end = len(data)
+        i = 0
+        while i < end:
+            if link.skip:
+                k = end - i
+                if k > link.skip:
+                    k = link.skip
+                link.skip -= k
+                i += k
+                continue
+            need = (_HEADER if link.fill < _HEADER else _HEADER + link.length) - link.fill
+            k = end - i
+            if k > need:
+                k = need
+            link.rx_mv[link.fill:link.fill + k] = mv[i:i + k]
+            link.fill += k
+            i += k
+            if link.fill == _HEADER:
+                link.length = struct.unpack_from("<H", link.rx, 0)[0]
+                if link.length > self._max_frame:
+                    # Discard its payload, across writes, then resync on the next header.
+                    self._reply(link, link.rx[2], STATUS_TOO_LARGE, None)
+                    link.fill = 0
+                    link.skip = link.length
+                    continue
+            if link.fill == _HEADER + link.length:
+                link.fill = 0
+                self._dispatch(link)
+
+    def _dispatch(self, link):
+        req_id = link.rx[2]
+        handler = self._methods.get(link.rx[3])
+        payload = link.rx_mv[_HEADER:_HEADER + link.length]
+        if handler is None:
+            self._reply(link, req_id, STATUS_UNKNOWN, None)
+        elif isGenerator(handler):
+            if link.inflight >= self._max_inflight:
+                self._reply(link, req_id, STATUS_BUSY, None)
+                return
+            link.inflight += 1
+            self._tasks.start(self._call(link, req_id, handler, bytes(payload)))
+        else:
+            try:
+                result = handler(link.conn_handle, payload)
+            except Exception:
+                self._reply(link, req_id, STATUS_ERROR, None)
+                return
+            self._reply(link, req_id, STATUS_OK, result)
+
+    async def _call(self, link, req_id, handler, payload):
+        try:
+            result = await handler(link.conn_handle, payload)
+            status = STATUS_OK
+        except Exception:
+            result = None
+            status = STATUS_ERROR
+        link.inflight -= 1
+        if self._links.get(link.conn_handle) is link:
+            self._reply(link, req_id, status, result)
+
+    def _reply(self, link, req_id, status, data):
+        n = len(data) if data else 0
+        if n > self._max_frame:
+            status = STATUS_TOO_LARGE
+            n = 0
+        struct.pack_into("<HBB", self._tx, 0, n, req_id, status)
+        if n:
+            self._tx_mv[_HEADER:_HEADER + n] = data
+        self._send(link, self._tx_mv[0:_HEADER + n])
+
+    def _send(self, link, frame):
+        if link.out:
+            link.out.append(bytes(frame))
+            return
+        i = self._push(link, frame, 0)
+        if i is not None and i < len(frame):
+            link.out.append(bytes(frame[i:]))
+            link.out_pos = 0
+            if not link.flushing:
+                link.flushing = True
+                self._tasks.start(self._flush(link))
+
+    def _push(self, link, frame, i):
+        # Notifies frame[i:] chunk by chunk; the offset reached, or None
+        # when the connection is gone.
+        size = self._peripheral.maxPayload(link.conn_handle)
+        end = len(frame)
+        while i < end:
+            try:
+                self._peripheral.gattsNotify(link.conn_handle, self._tx_handle, frame[i:i + size])
+            except OSError as e:
+                if isBusy(e):
+                    return i
+                return None
+            i += size
+        return end
+
+    async def _flush(self, link):
+        while link.out and self._links.get(link.conn_handle) is link:
+            frame = memoryview(link.out[0])
+            i = self._push(link, frame, link.out_pos)
+            if i is None:
+                break
+            if i < len(frame):
+                link.out_pos = i
+                await asyncio.sleep_ms(self._retry_ms)
+            else:
+                link.out.pop(0)
+                link.out_pos = 0
+        link.flushing = False
+
+    def close(self):
+        self._peripheral.onWrite(self._rx_handle, None)
+        self._peripheral.removeLinkHook(self._link_ref)
+        self._links.clear()
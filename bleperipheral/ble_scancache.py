@@ -0,0 +1,96 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.ble_advertising import AdvParser
+
+
+class ScanEntry:
+    def __init__(self, addr_type, addr, name, services, service_data):
+        self.addr_type = addr_type
+        self.addr = addr
+        self.name = name
+        self.services = services
+        self.service_data = service_data
+        self.rssi = 0
+        self.seen = 0
+        self._used = 0
+        self._hash = 0
+
+
+class ScanCache:
+    '''
+    Bounded LRU cache of decoded scan results, one entry per device
+    (addr_type, addr).
+
+    update() decodes a payload when it differs from the one last seen from
+    that device and returns None for unchanged re-advertisements, so dense
+    environments cost one hash per duplicate instead of a full decode.
+    A device whose payload changes keeps its single entry.
+    '''
+
+    def __init__(self, capacity=32):
+        self._capacity = capacity
+        self._entries = {}
+        self._clock = 0
+        self._parser = AdvParser()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, addr_type, addr, adv_data, rssi=0):
+        '''
+        returns
+        ----------
+            ScanEntry
+                when the payload is new for this device, otherwise None.
+        '''
+        self._clock += 1
+        addr = bytes(addr)
+        h = hash(bytes(adv_data))
+        key = (addr_type, addr)
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry._used = self._clock
+            entry.rssi = rssi
+            entry.seen += 1
+            if entry._hash == h:
+                self.hits += 1
+                return None
+        self.misses += 1
+        adv = self._parser.parse(adv_data)
+        service_data = adv.service_data()
+        service_data = bytes(service_data) if service_data else b""
+        if entry is None:
+            if len(self._entries) >= self._capacity:
+                self._evict()
+            entry = ScanEntry(addr_type, addr, adv.name(), adv.services(), service_data)
+            entry._used = self._clock
+            entry.rssi = rssi
+            entry.seen = 1
+            self._entries[key] = entry
+        else:
+            entry.name = adv.name()
+            entry.services = adv.services()
+            entry.service_data = service_data
+        entry._hash = h
+        return entry
+
+    def _evict(self):
+        oldest = None
+        used = 0
+        for key, entry in self._entries.items():
+            if oldest is None or entry._used < used:
+                oldest = key
+                used = entry._used
+        del self._entries[oldest]
+        self.evictions += 1
+
+    def entries(self):
+        return self._entries.values()
+
+    def clear(self):
+        self._entries.clear()
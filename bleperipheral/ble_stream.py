@@ -0,0 +1,277 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+from bleperipheral.util import uasyncio as asyncio, const, isBusy
+from bleperipheral.ble_uart import RingBuffer
+
+_ENOBUFS = const(105)
+_ENOTCONN = const(107)
+
+
+class StreamReader:
+    '''
+    Bytes written by one central to the RX characteristic, buffered in a
+    RingBuffer of capacity bytes (overflow counts what did not fit).
+    '''
+
+    def __init__(self, conn_handle, capacity):
+        self.conn_handle = conn_handle
+        self._rx = RingBuffer(capacity)
+        self._flag = asyncio.ThreadSafeFlag()
+        self._eof = False
+
+    def _feed(self, data):
+        self._rx.write(data)
+        self._flag.set()
+
+    def _close(self):
+        self._eof = True
+        self._flag.set()
+
+    @property
+    def overflow(self):
+        return self._rx.overflow
+
+    def at_eof(self):
+        return self._eof and not self._rx.any()
+
+    async def _wait(self):
+        while not self._rx.any():
+            if self._eof:
+                return False
+            await self._flag.wait()
+        return True
+
+    async def read(self, n=-1):
+        '''
+        returns
+        ----------
+            bytearray
+                at most n bytes (all buffered bytes when n < 0), b"" at EOF.
+        '''
+        if not await self._wait():
+            return b""
+        return self._rx.read(n if n >= 0 else None)
+
+    async def readinto(self, buf):
+        if not await self._wait():
+            return 0
+        return self._rx.readinto(buf)
+
+    async def readexactly(self, n):
+        buf = bytearray(n)
+        mv = memoryview(buf)
+        got = 0
+        while got < n:
+            if not await self._wait():
+                raise EOFError
+            got += self._rx.readinto(mv[got:])
+        return buf
+
+    async def readline(self):
+        '''
+        returns
+        ----------
+            bytearray
+                a line including b"\\n"; what is left (or b"") at EOF.
+        '''
+        while True:
+            line = self._rx.readline()
+            if line is not None:
+                return line
+            if self._eof:
+                return self._rx.read()
+            await self._flag.wait()
+
+
+class StreamWriter:
+    '''
+    Notifications to one central on the TX characteristic.
+
+    write() copies into a RingBuffer of capacity bytes and keeps up to
+    max_backlog more bytes until drain(), which returns once the stack has
+    accepted everything. A write() that does not fit raises
+    OSError(ENOBUFS) and buffers nothing; await drain() and write again.
+    '''
+
+    def __init__(self, server, conn_handle, capacity, max_backlog):
+        self.conn_handle = conn_handle
+        self._server = server
+        self._tx = RingBuffer(capacity)
+        self._backlog = None
+        self._max_backlog = max_backlog
+        self._closed = False
+
+    def get_extra_info(self, name):
+        if name == "conn_handle":
+            return self.conn_handle
+        return None
+
+    def write(self, buf):
+        if self._closed:
+            raise OSError(_ENOTCONN)
+        n = len(buf)
+        if self._backlog is not None:
+            if len(self._backlog) + n > self._max_backlog:
+                raise OSError(_ENOBUFS)
+            self._backlog += buf
+            return
+        free = self._tx.capacity() - len(self._tx)
+        if n - free > self._max_backlog:
+            raise OSError(_ENOBUFS)
+        if n <= free:
+            self._tx.write(buf)
+        else:
+            mv = memoryview(buf)
+            self._tx.write(mv[0:free])
+            self._backlog = bytearray(mv[free:])
+
+    def _pump(self):
+        # Hands chunks to the stack until it refuses; True when it did.
+        server = self._server
+        tx = self._tx
+        while True:
+            if self._backlog is not None and len(tx) < tx.capacity():
+                n = tx.write(memoryview(self._backlog)[0:tx.capacity() - len(tx)])
+                self._backlog = self._backlog[n:] if n < len(self._backlog) else None
+            if not tx.any():
+                return True
+            mv = server._chunk(self.conn_handle)
+            n = tx.peekinto(mv)
+            try:
+                server._peripheral.gattsNotify(self.conn_handle, server._tx_handle, mv[0:n])
+            except OSError as e:
+                if isBusy(e):
+                    return False
+                self._close()
+                raise
+            tx.skip(n)
+
+    async def drain(self):
+        while True:
+            if self._closed:
+                raise OSError(_ENOTCONN)
+            if self._pump():
+                return
+            await asyncio.sleep_ms(self._server._retry_ms)
+
+    def _close(self):
+        self._closed = True
+        self._tx.clear()
+        self._backlog = None
+
+    def close(self):
+        if not self._closed:
+            self._server._ble.gap_disconnect(self.conn_handle)
+            self._close()
+
+    async def wait_closed(self):
+        pass
+
+
+class StreamServer:
+    '''
+    uasyncio streams over a pair of characteristics of a BLEPeripheral:
+    centrals write to rx_handle and are notified on tx_handle.
+
+    Every connection gets a (StreamReader, StreamWriter) pair, returned
+    by accept(). The pair is created by accept() or by the first write of
+    the central, never in the IRQ. The reader reaches EOF when the central
+    disconnects.
+
+    parameters
+    ----------
+        peripheral:BLEPeripheral
+
+        rx_handle:int
+
+        tx_handle:int
+
+        capacity:int
+            RX and TX buffer size per connection.
+
+        retry_ms:int
+            drain() poll interval while the stack has no buffer free.
+
+        max_backlog:int
+            bytes a StreamWriter keeps beyond its TX buffer until drain()
+            (default: capacity).
+    '''
+
+    def __init__(self, peripheral, rx_handle, tx_handle, capacity=512, retry_ms=5, max_backlog=None):
+        self._peripheral = peripheral
+        self._ble = peripheral.ble
+        self._rx_handle = rx_handle
+        self._tx_handle = tx_handle
+        self._capacity = capacity
+        self._max_backlog = capacity if max_backlog is None else max_backlog
+        self._retry_ms = retry_ms
+        self._streams = {}
+        self._accept = []
+        self._flag = asyncio.ThreadSafeFlag()
+        self._buf = bytearray(peripheral.maxPayload())
+        self._mv = memoryview(self._buf)
+        self._link_ref = self._on_link
+        peripheral.addLinkHook(self._link_ref)
+        peripheral.onWrite(rx_handle, self._on_write)
+
+    def _open(self, conn_handle):
+        pair = (StreamReader(conn_handle, self._capacity), StreamWriter(self, conn_handle, self._capacity, self._max_backlog))
+        self._streams[conn_handle] = pair
+        self._accept.append(pair)
+        self._flag.set()
+        return pair
+
+    def _on_link(self, conn_handle, connected):
+        # IRQ: nothing is allocated here; accept() opens the streams.
+        if connected:
+            self._flag.set()
+        else:
+            self._drop(conn_handle)
+
+    def _drop(self, conn_handle):
+        pair = self._streams.pop(conn_handle, None)
+        if pair:
+            pair[0]._close()
+            pair[1]._close()
+
+    def _sync(self):
+        for conn_handle in self._peripheral.connections():
+            if conn_handle not in self._streams:
+                self._open(conn_handle)
+
+    def _on_write(self, conn_handle, value_handle, data):
+        pair = self._streams.get(conn_handle)
+        if pair is None:
+            pair = self._open(conn_handle)
+        pair[0]._feed(data)
+
+    def _chunk(self, conn_handle):
+        size = self._peripheral.maxPayload(conn_handle)
+        if size > len(self._buf):
+            self._buf = bytearray(size)
+            self._mv = memoryview(self._buf)
+        return self._mv[0:size]
+
+    def streams(self, conn_handle):
+        return self._streams.get(conn_handle)
+
+    async def accept(self):
+        '''
+        returns
+        ----------
+            tuple
+                (StreamReader, StreamWriter) of the next connection
+        '''
+        while True:
+            self._sync()
+            if self._accept:
+                return self._accept.pop(0)
+            await self._flag.wait()
+
+    def close(self):
+        self._peripheral.onWrite(self._rx_handle, None)
+        self._peripheral.removeLinkHook(self._link_ref)
+        for conn_handle in list(self._streams):
+            self._drop(conn_handle)
@@ -0,0 +1,375 @@
+'''
+bleperipheral package
+    Copyright (c) 2020 jp-96
+'''
+import io
+import os
+from bleperipheral.util import bluetooth, micropython, const, isBusy
+from bleperipheral.ble_peripheral import BLEPeripheral
+
+try:
+    import machine
+except ImportError:
+    machine = None
+
+
+_NEWLINE = const(0x0A)
+
+_MP_STREAM_POLL = const(3)
+_MP_STREAM_POLL_RD = const(0x0001)
+
+_UART_UUID = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
+_UART_TX = (
+    bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E"),
+    bluetooth.FLAG_NOTIFY,
+)
+_UART_RX = (
+    bluetooth.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E"),
+    bluetooth.FLAG_WRITE,
+)
+_UART_SERVICE = (
+    _UART_UUID,
+    (_UART_TX, _UART_RX,),
+)
+
+# org.bluetooth.characteristic.gap.appearance.xml
+_ADV_APPEARANCE_GENERIC_COMPUTER = const(128)
+
+
+class RingBuffer:
+    '''
+    Fixed-capacity byte FIFO. write() and readinto() copy at most two
+    memoryview slices; bytes that do not fit are dropped and counted in
+    overflow.
+    '''
+
+    def __init__(self, capacity):
+        self._buf = bytearray(capacity)
+        self._mv = memoryview(self._buf)
+        self._capacity = capacity
+        self._head = 0
+        self._count = 0
+        self.overflow = 0
+
+    def __len__(self):
+        return self._count
+
+    def any(self):
+        return self._count
+
+    def capacity(self):
+        return self._capacity
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def write(self, data):
+        '''
+        returns
+        ----------
+            int
+                bytes stored
+        '''
+        n = len(data)
+        free = self._capacity - self._count
+        if n > free:
+            self.overflow += n - free
+            n = free
+        if n == 0:
+            return 0
+        src = memoryview(data)
+        tail = self._head + self._count
+        if tail >= self._capacity:
+            tail -= self._capacity
+        k = self._capacity - tail
+        if k >= n:
+            self._mv[tail:tail + n] = src[0:n]
+        else:
+            self._mv[tail:] = src[0:k]
+            self._mv[0:n - k] = src[k:n]
+        self._count += n
+        return n
+
+    def readinto(self, buf, nbytes=None):
+        n = self.peekinto(buf, nbytes)
+        if n:
+            self._consume(n)
+        return n
+
+    def peekinto(self, buf, nbytes=None):
+        # Like readinto, but the bytes stay in the buffer until skip().
+        n = len(buf) if nbytes is None else nbytes
+        if n > self._count:
+            n = self._count
+        if n == 0:
+            return 0
+        dst = memoryview(buf)
+        head = self._head
+        k = self._capacity - head
+        if k >= n:
+            dst[0:n] = self._mv[head:head + n]
+        else:
+            dst[0:k] = self._mv[head:]
+            dst[k:n] = self._mv[0:n - k]
+        return n
+
+    def skip(self, n):
+        if n > self._count:
+            n = self._count
+        if n:
+            self._consume(n)
+
+    def _consume(self, n):
+        self._head += n
+        if self._head >= self._capacity:
+            self._head -= self._capacity
+        self._count -= n
+        if self._count == 0:
+            self._head = 0
+
+    def read(self, nbytes=None):
+        n = self._count if nbytes is None or nbytes > self._count else nbytes
+        result = bytearray(n)
+        self.readinto(result)
+        return result
+
+    def find(self, byte):
+        '''
+        parameters
+        ----------
+            byte:int
+
+        returns
+        ----------
+            int
+                index of the first byte equal to byte, or -1
+        '''
+        # MicroPython's bytearray has no find(): scan both segments.
+        mv = self._mv
+        head = self._head
+        end = head + self._count
+        stop = end if end <= self._capacity else self._capacity
+        for i in range(head, stop):
+            if mv[i] == byte:
+                return i - head
+        for i in range(0, end - stop):
+            if mv[i] == byte:
+                return i + self._capacity - head
+        return -1
+
+    def readline(self):
+        '''
+        returns
+        ----------
+            bytearray
+                up to and including the first b"\\n"; everything when the
+                buffer is full without one, otherwise None.
+        '''
+        i = self.find(_NEWLINE)
+        if i < 0:
+            if self._count < self._capacity:
+                return None
+            return self.read()
+        return self.read(i + 1)
+
+
+class BLEUART:
+    '''
+    Nordic UART Service (NUS) peripheral.
+
+    Received bytes go into a RingBuffer of rx_capacity bytes; rxbuf is the
+    size of the RX characteristic in the GATT database.
+    '''
+
+    def __init__(self, name="upy-uart", rxbuf=100, rx_capacity=512, ble=None):
+        self._bleperipheral = BLEPeripheral(ble)
+        # The 128-bit service UUID goes to the scan response if it does not fit.
+        ((self._tx_handle, self._rx_handle,),) = self._bleperipheral.build(
+            (_UART_SERVICE,),
+            adv_services=[_UART_UUID],
+            adv_name=name,
+            adv_appearance=_ADV_APPEARANCE_GENERIC_COMPUTER
+        )
+        # Increase the size of the rx buffer and enable append mode.
+        self._bleperipheral.setBuffer(self._rx_handle, rxbuf, True)
+        self._rx = RingBuffer(rx_capacity)
+        self._handler = None
+        # Connections the chunk being sent has reached.
+        self._sent = set()
+        self._bleperipheral.onWrite(self._rx_handle, self._gattsWrite)
+        self._bleperipheral.advertise()
+
+    @property
+    def peripheral(self):
+        return self._bleperipheral
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def _gattsWrite(self, handle, value_handle, data):
+        self._rx.write(data)
+        if self._handler:
+            self._handler()
+
+    def any(self):
+        return self._rx.any()
+
+    def read(self, sz=None):
+        return self._rx.read(sz)
+
+    def readinto(self, buf, nbytes=None):
+        return self._rx.readinto(buf, nbytes)
+
+    def readline(self):
+        return self._rx.readline()
+
+    @property
+    def overflow(self):
+        # Received bytes dropped because the ring buffer was full.
+        return self._rx.overflow
+
+    def write(self, data):
+        # Notifications carry at most mtu - 3 bytes.
+        size = self._bleperipheral.maxPayload()
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) <= size:
+            self._bleperipheral.notify(self._tx_handle, data)
+            return
+        mv = memoryview(data)
+        for i in range(0, len(data), size):
+            self._bleperipheral.notify(self._tx_handle, mv[i:i + size])
+
+    def send(self, data):
+        '''
+        One notification of at most chunkSize() bytes to every connection.
+
+        returns
+        ----------
+            bool,None
+                False when the stack has no buffer free for some connection:
+                call send() again later with the same data, it only goes to
+                the connections that have not got it yet.
+                None when there is no connection to send to.
+        '''
+        p = self._bleperipheral
+        if not p.isConnected():
+            self._sent.clear()
+            return None
+        sent = self._sent
+        for conn_handle in p.connections():
+            if conn_handle in sent:
+                continue
+            try:
+                p.gattsNotify(conn_handle, self._tx_handle, data)
+            except OSError as e:
+                if isBusy(e):
+                    return False
+                # Going away; the disconnect follows.
+            sent.add(conn_handle)
+        sent.clear()
+        return True
+
+    def chunkSize(self):
+        return self._bleperipheral.maxPayload()
+
+    def requestMtu(self, mtu=247):
+        self._bleperipheral.requestMtu(mtu)
+
+    def close(self):
+        self._bleperipheral.close()
+
+
+class BLEUARTStream(io.IOBase):
+    '''
+    Stream over a BLEUART that meets the os.dupterm requirements.
+
+    write() sends at once while the stack accepts notifications, in chunks
+    of the negotiated MTU. When the stack is busy the rest waits in a TX
+    ring buffer of tx_capacity bytes, where later writes coalesce with it,
+    and is retried after retry_ms.
+    '''
+
+    def __init__(self, uart, tx_capacity=1024, retry_ms=10):
+        self._uart = uart
+        self._tx = RingBuffer(tx_capacity)
+        self._chunk = bytearray(uart.chunkSize())
+        self._chunk_mv = memoryview(self._chunk)
+        self._retry_ms = retry_ms
+        self._pending = False
+        self._partial = 0
+        self._flush_ref = self._on_timer
+        if machine and hasattr(machine, "Timer"):
+            self._timer = machine.Timer(-1)
+        else:
+            self._timer = None
+        self._uart.irq(self._on_rx)
+
+    def _on_rx(self):
+        # Needed for ESP32.
+        if hasattr(os, "dupterm_notify"):
+            os.dupterm_notify(None)
+
+    def read(self, sz=None):
+        return self._uart.read(sz)
+
+    def readinto(self, buf):
+        return self._uart.readinto(buf) or None
+
+    def readline(self):
+        return self._uart.readline()
+
+    def ioctl(self, op, arg):
+        if op == _MP_STREAM_POLL:
+            if self._uart.any():
+                return _MP_STREAM_POLL_RD
+        return 0
+
+    def _schedule(self):
+        self._pending = True
+        if self._timer:
+            self._timer.init(mode=machine.Timer.ONE_SHOT, period=self._retry_ms, callback=self._flush_ref)
+        else:
+            try:
+                micropython.schedule(self._flush_ref, None)
+            except RuntimeError:
+                # Queue full; the next write() flushes.
+                self._pending = False
+
+    def _on_timer(self, _arg):
+        self._flush()
+
+    def _flush(self):
+        self._pending = False
+        tx = self._tx
+        while tx.any():
+            size = self._uart.chunkSize()
+            if size > len(self._chunk):
+                self._chunk = bytearray(size)
+                self._chunk_mv = memoryview(self._chunk)
+            # A chunk some connections already got is retried unchanged.
+            n = tx.peekinto(self._chunk_mv, self._partial or size)
+            sent = self._uart.send(self._chunk_mv[0:n])
+            if sent is None:
+                # Nobody to send to.
+                self._partial = 0
+                tx.clear()
+                return
+            if not sent:
+                self._partial = n
+                self._schedule()
+                return
+            self._partial = 0
+            tx.skip(n)
+
+    def write(self, buf):
+        n = self._tx.write(buf)
+        if not self._pending:
+            self._flush()
+        return n
+
+    @property
+    def overflow(self):
+        # Bytes dropped because the TX ring buffer was full.
+        return self._tx.overflow
@@ -7,6 +7,7 @@ import bluetooth
 import micropython
 import uasyncio
 from micropython import const
+from utime import ticks_ms, ticks_us, ticks_diff, ticks_add
 
 def _f():
     pass
@@ -22,11 +23,71 @@ _type_function = type(_f)
 _type_generator = type(_g)
 _type_bound_method = type(_B()._b)
 
-def isFunction(obj):
-    return type(obj) == _type_function
+if _type_generator == _type_function:
+    # CPython (host stand-ins): coroutine functions are plain functions.
+    def isFunction(obj):
+        return type(obj) == _type_function and not obj.__code__.co_flags & 0x80
 
-def isGenerator(obj):
-    return type(obj) == _type_generator
+    def isGenerator(obj):
+        return type(obj) == _type_function and bool(obj.__code__.co_flags & 0x80)
+else:
+    def isFunction(obj):
+        return type(obj) == _type_function
+
+    def isGenerator(obj):
+        return type(obj) == _type_generator
 
 def isBoundMethod(obj):
     return type(obj) == _type_bound_method
+
+_EAGAIN = const(11)
+_ENOMEM = const(12)
+_EBUSY  = const(16)
+
+def isBusy(e):
+    # OSError of a notify the stack cannot take now: retry later.
+    return e.args[0] in (_ENOMEM, _EAGAIN, _EBUSY)
+
+class TaskLauncher:
+    '''
+    Starts coroutines as uasyncio tasks from scheduled callbacks.
+
+    start() queues the coroutine and sets a ThreadSafeFlag; a long-lived
+    task then creates one task per coroutine on the event loop. Only the
+    first start() creates a task directly, the launcher itself.
+    '''
+
+    def __init__(self):
+        self._ready = []
+        self._flag = None
+
+    def start(self, coro):
+        self._ready.append(coro)
+        if self._flag is None:
+            self._flag = uasyncio.ThreadSafeFlag()
+            uasyncio.get_event_loop().create_task(self._run())
+        self._flag.set()
+
+    async def _run(self):
+        ready = self._ready
+        while True:
+            await self._flag.wait()
+            while ready:
+                uasyncio.create_task(ready.pop(0))
+
+class Periodic:
+    '''
+    Base for objects driven by tick(): run() calls it every period_ms
+    (default: _period_ms) until stop().
+    '''
+    _period_ms = 100
+    _running = False
+
+    async def run(self, period_ms=None):
+        self._running = True
+        while self._running:
+            self.tick()
+            await uasyncio.sleep_ms(period_ms or self._period_ms)
+
+    def stop(self):
+        self._running = False
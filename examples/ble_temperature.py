@@ -1,21 +1,26 @@
 # This example demonstrates a simple temperature sensor peripheral.
 #
-# The sensor's local value updates every second, and it will notify
-# any connected central every 10 seconds.
+# The sensor is sampled when a central reads the value (at most once a
+# second) and, while a central is connected, every second. Connected
+# centrals are notified when it moves by more than 0.2 degrees (at most
+# once a second), and at least every 10 seconds.
 
 import bluetooth
 import random
-import struct
 import time
 from micropython import const
 from bleperipheral import BLEPeripheral
+from bleperipheral.ble_publish import Publisher
+from bleperipheral.ble_codec import SInt16
 
 # org.bluetooth.service.environmental_sensing
 _ENV_SENSE_UUID = bluetooth.UUID(0x181A)
+_FLAG_READ_AUTHORIZED = const(0x0200)
+
 # org.bluetooth.characteristic.temperature
 _TEMP_CHAR = (
     bluetooth.UUID(0x2A6E),
-    bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY,
+    bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY | _FLAG_READ_AUTHORIZED,
 )
 _ENV_SENSE_SERVICE = (
     _ENV_SENSE_UUID,
@@ -27,7 +32,8 @@ _ADV_APPEARANCE_GENERIC_THERMOMETER = const(768)
 
 
 class BLETemperature:
-    def __init__(self, connected, disconnected, multi_connections):
+    def __init__(self, connected, disconnected, multi_connections, sensor):
+        self._sensor = sensor
         self._bleperipheral = BLEPeripheral(multi_connections=multi_connections)
         self._bleperipheral.irq(connected,disconnected)
         ((self._handleTempChar,),) = self._bleperipheral.build(
@@ -36,12 +42,23 @@ class BLETemperature:
             adv_name="upy-temp",
             adv_appearance=_ADV_APPEARANCE_GENERIC_THERMOMETER
         )
+        # Data is sint16 in degrees Celsius with a resolution of 0.01 degrees Celsius.
+        self._publisher = Publisher(self._bleperipheral)
+        self._publisher.add(self._handleTempChar, SInt16(100), deadband=0.2, min_interval_ms=1000, max_interval_ms=10000)
+        # Reads sample the sensor on demand.
+        self._bleperipheral.onRead(self._handleTempChar, self._read, ttl_ms=1000, codec=SInt16(100))
         self._bleperipheral.advertise()
 
-    def set_temperature(self, temp_deg_c, notify=False):
-        # Data is sint16 in degrees Celsius with a resolution of 0.01 degrees Celsius.
-        # Write the local value, ready for a central to read.
-        self._bleperipheral.write(self._handleTempChar, struct.pack("<h", int(temp_deg_c * 100)), notify)
+    def _read(self, conn_handle, value_handle):
+        return self._sensor()
+
+    def update(self):
+        # Nobody to notify: leave sampling to reads.
+        if not self._bleperipheral.isConnected():
+            return
+        # Write the local value and notify if due.
+        self._publisher.publish(self._handleTempChar, self._sensor())
+        self._publisher.tick()
 
 
 def demo(multi_connections=0):
@@ -52,18 +69,18 @@ def demo(multi_connections=0):
     def disconnected(sender, conn_handle):
         print("Disconnected: {}".format(conn_handle))
 
-    temp = BLETemperature(connected, disconnected, multi_connections)
+    t = [25]
 
-    t = 25
-    i = 0
+    def sensor():
+        # Random walk the temperature.
+        t[0] += random.uniform(-0.5, 0.5)
+        print(t[0])
+        return t[0]
+
+    temp = BLETemperature(connected, disconnected, multi_connections, sensor)
 
     while True:
-        # Write every second, notify every 10 seconds.
-        i = (i + 1) % 10
-        print(i, t)
-        temp.set_temperature(t, notify=i == 0)
-        # Random walk the temperature.
-        t += random.uniform(-0.5, 0.5)
+        temp.update()
         time.sleep_ms(1000)
 
 
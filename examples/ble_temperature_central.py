@@ -6,7 +6,7 @@ import struct
 import time
 import micropython
 
-from bleperipheral import decode_services, decode_name
+from bleperipheral.ble_scancache import ScanCache
 
 from micropython import const
 
@@ -54,6 +54,7 @@ class BLETemperatureCentral:
         self._ble = ble
         self._ble.active(True)
         self._ble.irq(self._irq)
+        self._scan_cache = ScanCache()
 
         self._reset()
 
@@ -82,15 +83,15 @@ class BLETemperatureCentral:
     def _irq(self, event, data):
         if event == _IRQ_SCAN_RESULT:
             addr_type, addr, adv_type, rssi, adv_data = data
-            if adv_type in (_ADV_IND, _ADV_DIRECT_IND,) and _ENV_SENSE_UUID in decode_services(
-                adv_data
-            ):
+            if adv_type not in (_ADV_IND, _ADV_DIRECT_IND,):
+                return
+            # Decoded once per device and payload; unchanged re-advertisements return None.
+            entry = self._scan_cache.update(addr_type, addr, adv_data, rssi)
+            if entry and _ENV_SENSE_UUID in entry.services:
                 # Found a potential device, remember it and stop scanning.
                 self._addr_type = addr_type
-                self._addr = bytes(
-                    addr
-                )  # Note: addr buffer is owned by caller so need to copy it.
-                self._name = decode_name(adv_data) or "?"
+                self._addr = entry.addr  # A copy; the addr buffer is owned by the caller.
+                self._name = entry.name or "?"
                 self._ble.gap_scan(None)
 
         elif event == _IRQ_SCAN_COMPLETE:
@@ -160,6 +161,7 @@ class BLETemperatureCentral:
         self._addr_type = None
         self._addr = None
         self._scan_callback = callback
+        self._scan_cache.clear()
         self._ble.gap_scan(2000, 30000, 30000)
 
     # Connect to the specified device (otherwise use cached address from a scan).
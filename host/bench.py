@@ -0,0 +1,318 @@
+'''
+bleperipheral package - event replay benchmark
+    Copyright (c) 2020 jp-96
+
+usage
+----------
+    python host/bench.py [scenario ...] [--trace FILE] [--repeat N]
+                         [--zero-copy] [--coalesce] [--capacity N]
+    python host/bench.py --boot [--repeat N]
+
+    Replays connect/write/disconnect traces through BLEPeripheral._irq on the
+    simulated stack and reports events/sec, heap allocated per IRQ and the
+    latency between an IRQ and its scheduled callback.
+
+    Allocations are measured with tracemalloc in a separate, untimed pass.
+
+    --boot reports BLEPeripheral.timeToAdvertise for build() and for
+    restore() from a boot cache file.
+
+trace file
+----------
+    One JSON array per line:
+        ["connect", conn_handle]
+        ["write", conn_handle, "<characteristic name>", "<hex data>"]
+        ["disconnect", conn_handle]
+        ["drain"]            # the VM gets to run the scheduled callbacks
+'''
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+if _HERE not in sys.path:
+    sys.path.insert(0, _HERE)
+sys.path.insert(1, os.path.dirname(_HERE))
+
+import bluetooth  # noqa: E402
+import micropython  # noqa: E402
+from bleperipheral import BLEPeripheral, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE  # noqa: E402
+from bleperipheral import ble_bootcache  # noqa: E402
+
+_UART_SERVICE = (
+    bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E"),
+    (
+        (bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E"), bluetooth.FLAG_NOTIFY,),
+        (bluetooth.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E"), bluetooth.FLAG_WRITE,),
+    ),
+)
+_CONFIG_SERVICE = (
+    bluetooth.UUID(0x181A),
+    (
+        (bluetooth.UUID(0x2A6E), bluetooth.FLAG_READ | bluetooth.FLAG_WRITE,),
+    ),
+)
+
+
+def sensor_config(writes=1000):
+    # A phone tweaking a config characteristic; the VM keeps up.
+    trace = [("connect", 0), ("drain",)]
+    for i in range(writes):
+        trace.append(("write", 0, "cfg", bytes((i & 0xFF, 0x01))))
+        trace.append(("drain",))
+    trace.append(("disconnect", 0))
+    trace.append(("drain",))
+    return trace
+
+
+def uart_burst(writes=1000, burst=16):
+    # REPL paste: writes arrive faster than scheduled callbacks run.
+    trace = [("connect", 0), ("drain",)]
+    for i in range(writes):
+        trace.append(("write", 0, "rx", b"0123456789abcdefghij"))
+        if i % burst == burst - 1:
+            trace.append(("drain",))
+    trace.append(("drain",))
+    trace.append(("disconnect", 0))
+    trace.append(("drain",))
+    return trace
+
+
+def reconnect_storm(cycles=500):
+    trace = []
+    for i in range(cycles):
+        trace.append(("connect", i & 0x0F))
+        trace.append(("disconnect", i & 0x0F))
+        trace.append(("drain",))
+    return trace
+
+
+SCENARIOS = {
+    "sensor_config": sensor_config,
+    "uart_burst": uart_burst,
+    "reconnect_storm": reconnect_storm,
+}
+
+
+def load_trace(path):
+    trace = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line)
+            if item[0] == "write":
+                item[3] = bytes.fromhex(item[3])
+            trace.append(tuple(item))
+    return trace
+
+
+class Rig:
+    def __init__(self, options):
+        micropython.reset()
+        self.ble = bluetooth.BLE()
+        self.peripheral = BLEPeripheral(
+            self.ble, multi_connections=-1, event_capacity=options.get("capacity", 16),
+            overflow=OVERFLOW_COALESCE if options.get("coalesce") else OVERFLOW_DROP_OLDEST,
+        )
+        ((tx, rx,), (cfg,),) = self.peripheral.build(
+            (_UART_SERVICE, _CONFIG_SERVICE,), adv_name="bench", zero_copy=options.get("zero_copy", False)
+        )
+        self.peripheral.setBuffer(rx, 100, True)
+        self.handles = {"tx": tx, "rx": rx, "cfg": cfg}
+        self.received = 0
+        self.peripheral.irq(self._connected, self._disconnected, self._write)
+        self.peripheral.advertise()
+
+    def _connected(self, conn_handle):
+        pass
+
+    def _disconnected(self, conn_handle):
+        pass
+
+    def _write(self, conn_handle, value_handle, value):
+        self.received += len(value)
+
+
+def _inject(ble, handles, item):
+    op = item[0]
+    if op == "write":
+        ble.injectWrite(item[1], handles[item[2]], item[3])
+    elif op == "connect":
+        ble.injectConnect(item[1])
+    elif op == "disconnect":
+        ble.injectDisconnect(item[1])
+    else:
+        raise ValueError("unknown trace op: {}".format(op))
+
+
+def replay(trace, options):
+    rig = Rig(options)
+    ble = rig.ble
+    handles = rig.handles
+    events = 0
+    lost = 0
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = time.perf_counter_ns()
+        for item in trace:
+            if item[0] == "drain":
+                micropython.run_scheduled()
+                continue
+            try:
+                _inject(ble, handles, item)
+            except RuntimeError:
+                # On the device the stack prints the exception and the event is gone.
+                lost += 1
+            events += 1
+        micropython.run_scheduled()
+        elapsed = time.perf_counter_ns() - t0
+    finally:
+        gc.enable()
+    latency = sorted(micropython.stats["latency_ns"])
+    result = {
+        "events": events,
+        "lost": lost,
+        "events_per_sec": events * 1e9 / elapsed if elapsed else 0.0,
+        "latency_p50_us": _percentile(latency, 50) / 1000,
+        "latency_p99_us": _percentile(latency, 99) / 1000,
+        "received": rig.received,
+        "dropped": rig.peripheral.droppedEvents,
+        "coalesced": rig.peripheral.coalescedEvents,
+    }
+    result.update(allocations(trace, options))
+    return result
+
+
+def allocations(trace, options):
+    '''
+    Replays trace again under tracemalloc. Per IRQ, the peak traced memory
+    above the level before the call counts everything allocated in it,
+    including temporaries CPython frees before it returns. Snapshots
+    before and after the replay give the blocks bleperipheral still holds.
+    '''
+    rig = Rig(options)
+    ble = rig.ble
+    handles = rig.handles
+    events = 0
+    allocated = 0
+    package = os.path.join(os.path.dirname(_HERE), "bleperipheral", "*")
+    filters = (tracemalloc.Filter(True, package),)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        for item in trace:
+            if item[0] == "drain":
+                micropython.run_scheduled()
+                continue
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            try:
+                _inject(ble, handles, item)
+            except RuntimeError:
+                pass
+            allocated += tracemalloc.get_traced_memory()[1] - current
+            events += 1
+        micropython.run_scheduled()
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+    finally:
+        tracemalloc.stop()
+    held = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "bytes_per_event": allocated / events if events else 0.0,
+        "held_blocks": held,
+    }
+
+
+def _percentile(samples, p):
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, len(samples) * p // 100)]
+
+
+def _report(name, results):
+    best = max(results, key=lambda r: r["events_per_sec"])
+    print(
+        "{:<18} {:>7} {:>6} {:>7} {:>7} {:>12.0f} {:>10.1f} {:>6} {:>9.1f} {:>9.1f} {:>9}".format(
+            name, best["events"], best["lost"], best["dropped"], best["coalesced"], best["events_per_sec"],
+            best["bytes_per_event"], best["held_blocks"], best["latency_p50_us"], best["latency_p99_us"], best["received"],
+        )
+    )
+
+
+def boot(repeat):
+    path = os.path.join(tempfile.mkdtemp(), "ble_boot.bin")
+    cold = []
+    cached = []
+    frozen = []
+    for _ in range(repeat):
+        p = BLEPeripheral(bluetooth.BLE())
+        p.build((_UART_SERVICE, _CONFIG_SERVICE,), adv_services=[_UART_SERVICE[0]], adv_name="bench", adv_appearance=128)
+        p.advertise()
+        cold.append(p.timeToAdvertise)
+        ble_bootcache.save(p, path)
+        image = ble_bootcache.image(p)
+        # The file is read after the peripheral is created, as at boot.
+        p = BLEPeripheral(bluetooth.BLE())
+        p.restore(ble_bootcache.load(path))
+        cached.append(p.timeToAdvertise)
+        # A frozen image module is already in memory.
+        p = BLEPeripheral(bluetooth.BLE())
+        p.restore(image)
+        frozen.append(p.timeToAdvertise)
+    print("{:<18} {:>12} {:>12}".format("boot", "min us", "p50 us"))
+    for name, samples in (("build", sorted(cold)), ("restore file", sorted(cached)), ("restore frozen", sorted(frozen))):
+        print("{:<18} {:>12} {:>12}".format(name, samples[0], _percentile(samples, 50)))
+
+
+def main(argv):
+    names = []
+    traces = []
+    repeat = 3
+    options = {}
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--trace":
+            i += 1
+            traces.append((os.path.basename(argv[i]), load_trace(argv[i])))
+        elif argv[i] == "--repeat":
+            i += 1
+            repeat = int(argv[i])
+        elif argv[i] == "--zero-copy":
+            options["zero_copy"] = True
+        elif argv[i] == "--coalesce":
+            options["coalesce"] = True
+        elif argv[i] == "--capacity":
+            i += 1
+            options["capacity"] = int(argv[i])
+        elif argv[i] == "--boot":
+            options["boot"] = True
+        else:
+            names.append(argv[i])
+        i += 1
+    if options.get("boot"):
+        boot(repeat)
+        return
+    if not names and not traces:
+        names = sorted(SCENARIOS)
+    for name in names:
+        traces.append((name, SCENARIOS[name]()))
+
+    print(
+        "{:<18} {:>7} {:>6} {:>7} {:>7} {:>12} {:>10} {:>6} {:>9} {:>9} {:>9}".format(
+            "trace", "events", "lost", "dropped", "merged", "events/s", "alloc B/ev", "held", "p50 us", "p99 us", "rx bytes"
+        )
+    )
+    for name, trace in traces:
+        _report(name, [replay(trace, options) for _ in range(repeat)])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,223 @@
+'''
+bleperipheral package - host side stand-in for the micropython bluetooth module
+    Copyright (c) 2020 jp-96
+'''
+# Only the peripheral (GATTS/GAP) subset used by bleperipheral is simulated.
+# The central side of a connection is driven by the inject* methods.
+
+FLAG_BROADCAST = 0x0001
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+FLAG_INDICATE = 0x0020
+FLAG_READ_AUTHORIZED = 0x0200
+
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+_IRQ_GATTS_READ_REQUEST = 4
+_IRQ_MTU_EXCHANGED = 21
+_IRQ_CONNECTION_UPDATE = 27
+
+_DEFAULT_BUFFER = 20
+
+_ENOMEM = 12
+
+
+class UUID:
+    def __init__(self, value):
+        if isinstance(value, UUID):
+            self._b = value._b
+        elif isinstance(value, int):
+            if value < 0 or value > 0xFFFFFFFF:
+                raise ValueError("invalid UUID")
+            self._b = value.to_bytes(2 if value <= 0xFFFF else 4, "little")
+        elif isinstance(value, str):
+            h = value.replace("-", "")
+            if len(h) != 32:
+                raise ValueError("invalid UUID")
+            self._b = bytes(reversed(bytes.fromhex(h)))
+        else:
+            b = bytes(value)
+            if len(b) not in (2, 4, 16):
+                raise ValueError("invalid UUID")
+            self._b = b
+
+    def __bytes__(self):
+        return self._b
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self._b == other._b
+
+    def __hash__(self):
+        return hash(self._b)
+
+    def __repr__(self):
+        if len(self._b) == 16:
+            h = bytes(reversed(self._b)).hex().upper()
+            return "UUID('{}-{}-{}-{}-{}')".format(h[0:8], h[8:12], h[12:16], h[16:20], h[20:32])
+        return "UUID(0x{:04x})".format(int.from_bytes(self._b, "little"))
+
+
+class BLE:
+    '''
+    Simulated BLE radio.
+
+    Every call made by the code under test is appended to `calls` as
+    (method, args) so that benchmarks and experiments can inspect it.
+    '''
+
+    def __init__(self):
+        self._active = False
+        self._handler = None
+        self._next_handle = 1
+        self._values = {}
+        self._append = {}
+        self._config = {"mtu": 23, "gap_name": b"MPY BTSTACK"}
+        self.connections = set()
+        self.mtus = {}
+        # MTU the simulated central offers in an exchange.
+        self.central_mtu = 247
+        self.advertising = None
+        self.calls = []
+        self.notified = []
+        # Simulated TX buffers: None means unlimited, otherwise gatts_notify
+        # raises OSError(ENOMEM) until txComplete() frees some.
+        self.tx_capacity = None
+        self.tx_inflight = 0
+
+    # --- micropython API -------------------------------------------------
+
+    def active(self, value=None):
+        if value is not None:
+            self._active = bool(value)
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def gatts_register_services(self, services_definition):
+        result = []
+        for service in services_definition:
+            _, characteristics = service[0], service[1]
+            self._next_handle += 1
+            handles = []
+            for characteristic in characteristics:
+                flags = characteristic[1]
+                self._next_handle += 1
+                handles.append(self._alloc(self._next_handle))
+                self._next_handle += 1
+                if flags & (FLAG_NOTIFY | FLAG_INDICATE):
+                    self._next_handle += 1
+                if len(characteristic) > 2:
+                    for _ in characteristic[2]:
+                        handles.append(self._alloc(self._next_handle))
+                        self._next_handle += 1
+            result.append(tuple(handles))
+        self.calls.append(("gatts_register_services", (services_definition,)))
+        return tuple(result)
+
+    def gatts_read(self, value_handle):
+        value = bytes(self._values[value_handle][1])
+        if self._append.get(value_handle):
+            self._values[value_handle][1] = bytearray()
+        return value
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._values[value_handle][1] = bytearray(data)
+        self.calls.append(("gatts_write", (value_handle, data)))
+        if send_update:
+            for conn_handle in self.connections:
+                self.notified.append((conn_handle, value_handle, bytes(data)))
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        if conn_handle not in self.connections:
+            raise OSError(128)
+        if self.tx_capacity is not None:
+            if self.tx_inflight >= self.tx_capacity:
+                raise OSError(_ENOMEM)
+            self.tx_inflight += 1
+        if data is None:
+            data = self._values[value_handle][1]
+        # The stack truncates values to what fits in one ATT packet.
+        self.notified.append((conn_handle, value_handle, bytes(data[: self.mtus.get(conn_handle, 23) - 3])))
+
+    def gatts_indicate(self, conn_handle, value_handle):
+        self.gatts_notify(conn_handle, value_handle)
+
+    def gatts_set_buffer(self, value_handle, length, append=False):
+        self._values[value_handle][0] = length
+        self._append[value_handle] = append
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        # The stack keeps its own copy of the payloads.
+        adv_data = bytes(adv_data) if adv_data is not None else None
+        resp_data = bytes(resp_data) if resp_data is not None else None
+        self.calls.append(("gap_advertise", (interval_us, adv_data, resp_data)))
+        if interval_us is None:
+            self.advertising = None
+        else:
+            self.advertising = (interval_us, adv_data, resp_data, connectable)
+
+    def gattc_exchange_mtu(self, conn_handle):
+        self.calls.append(("gattc_exchange_mtu", (conn_handle,)))
+        self.injectMtu(conn_handle, min(self._config["mtu"], self.central_mtu))
+
+    def gap_disconnect(self, conn_handle):
+        self.calls.append(("gap_disconnect", (conn_handle,)))
+        return conn_handle in self.connections
+
+    # --- central side injection -------------------------------------------
+
+    def _alloc(self, handle):
+        self._values[handle] = [_DEFAULT_BUFFER, bytearray()]
+        return handle
+
+    def inject(self, event, data):
+        # Runs the registered handler the way the stack does from its IRQ.
+        return self._handler(event, data)
+
+    def injectConnect(self, conn_handle, addr_type=0, addr=b"\x00\x11\x22\x33\x44\x55"):
+        self.connections.add(conn_handle)
+        self.inject(_IRQ_CENTRAL_CONNECT, (conn_handle, addr_type, memoryview(addr)))
+
+    def injectDisconnect(self, conn_handle, addr_type=0, addr=b"\x00\x11\x22\x33\x44\x55"):
+        self.connections.discard(conn_handle)
+        self.mtus.pop(conn_handle, None)
+        self.inject(_IRQ_CENTRAL_DISCONNECT, (conn_handle, addr_type, memoryview(addr)))
+
+    def injectMtu(self, conn_handle, mtu):
+        self.mtus[conn_handle] = mtu
+        self.inject(_IRQ_MTU_EXCHANGED, (conn_handle, mtu))
+
+    def injectConnectionUpdate(self, conn_handle, interval, latency=0, timeout=400, status=0):
+        # interval in 1.25 ms units, timeout in 10 ms units.
+        self.inject(_IRQ_CONNECTION_UPDATE, (conn_handle, interval, latency, timeout, status))
+
+    def injectRead(self, conn_handle, value_handle):
+        # Returns (status the handler returned, value the central gets).
+        status = self.inject(_IRQ_GATTS_READ_REQUEST, (conn_handle, value_handle))
+        if status:
+            return status, None
+        return 0, bytes(self._values[value_handle][1])
+
+    def txComplete(self, n=None):
+        # The controller has sent n queued notifications (all when None).
+        if n is None or n >= self.tx_inflight:
+            self.tx_inflight = 0
+        else:
+            self.tx_inflight -= n
+
+    def injectWrite(self, conn_handle, value_handle, data):
+        length, value = self._values[value_handle]
+        if self._append.get(value_handle):
+            value += data[: max(0, length - len(value))]
+        else:
+            self._values[value_handle][1] = bytearray(data[:length])
+        self.inject(_IRQ_GATTS_WRITE, (conn_handle, value_handle))
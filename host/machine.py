@@ -0,0 +1,66 @@
+'''
+bleperipheral package - host side stand-in for the micropython machine module
+    Copyright (c) 2020 jp-96
+'''
+from utime import ticks_ms, ticks_add, ticks_diff
+
+_armed = []
+
+
+class Timer:
+    '''
+    Software timer. Callbacks run from run_timers(), not from a thread,
+    so experiments stay deterministic.
+    '''
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self._id = id
+        self._mode = Timer.PERIODIC
+        self._period = 0
+        self._callback = None
+        self._deadline = 0
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None):
+        self.deinit()
+        self._mode = mode
+        self._period = period
+        self._callback = callback
+        self._deadline = ticks_add(ticks_ms(), period)
+        _armed.append(self)
+
+    def deinit(self):
+        if self in _armed:
+            _armed.remove(self)
+
+
+def pending():
+    return len(_armed)
+
+
+def run_timers(now=None):
+    '''
+    Fires every armed timer whose period has elapsed.
+
+    returns
+    ----------
+        int
+            number of callbacks run
+    '''
+    if now is None:
+        now = ticks_ms()
+    n = 0
+    for t in list(_armed):
+        if ticks_diff(now, t._deadline) < 0:
+            continue
+        if t._mode == Timer.ONE_SHOT:
+            _armed.remove(t)
+        else:
+            t._deadline = ticks_add(t._deadline, t._period)
+        n += 1
+        if t._callback:
+            t._callback(t)
+    return n
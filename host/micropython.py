@@ -0,0 +1,55 @@
+'''
+bleperipheral package - host side stand-in for the micropython module
+    Copyright (c) 2020 jp-96
+'''
+import time
+
+# MICROPY_SCHEDULER_DEPTH on the esp32 port.
+SCHEDULER_DEPTH = 8
+
+_queue = []
+stats = {"scheduled": 0, "full": 0, "run": 0, "latency_ns": []}
+
+
+def const(value):
+    return value
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(func, arg):
+    if len(_queue) >= SCHEDULER_DEPTH:
+        stats["full"] += 1
+        raise RuntimeError("schedule queue full")
+    _queue.append((func, arg, time.perf_counter_ns()))
+    stats["scheduled"] += 1
+
+
+def pending():
+    return len(_queue)
+
+
+def run_scheduled():
+    '''
+    Runs pending callbacks the way the VM does between bytecodes,
+    including callbacks scheduled while draining.
+    '''
+    latency = stats["latency_ns"]
+    n = 0
+    while _queue:
+        func, arg, t = _queue.pop(0)
+        latency.append(time.perf_counter_ns() - t)
+        func(arg)
+        n += 1
+    stats["run"] += n
+    return n
+
+
+def reset():
+    del _queue[:]
+    stats["scheduled"] = 0
+    stats["full"] = 0
+    stats["run"] = 0
+    stats["latency_ns"] = []
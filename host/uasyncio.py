@@ -0,0 +1,43 @@
+'''
+bleperipheral package - host side stand-in for the uasyncio module
+    Copyright (c) 2020 jp-96
+'''
+from asyncio import *  # noqa: F401,F403
+import asyncio as _asyncio
+
+
+def sleep_ms(ms):
+    return _asyncio.sleep(ms / 1000)
+
+
+def get_event_loop():
+    try:
+        return _asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    try:
+        return _asyncio.get_event_loop_policy().get_event_loop()
+    except RuntimeError:
+        loop = _asyncio.new_event_loop()
+        _asyncio.set_event_loop(loop)
+        return loop
+
+
+class ThreadSafeFlag:
+    # The host has no real IRQs; set() is called from the same thread.
+    def __init__(self):
+        self._event = Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+def wait_for_ms(aw, timeout):
+    return wait_for(aw, timeout / 1000)
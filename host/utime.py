@@ -0,0 +1,33 @@
+'''
+bleperipheral package - host side stand-in for the utime module
+    Copyright (c) 2020 jp-96
+'''
+from time import *  # noqa: F401,F403
+import time as _time
+
+_PERIOD = 1 << 30
+
+
+def ticks_ms():
+    return (_time.monotonic_ns() // 1000000) & (_PERIOD - 1)
+
+
+def ticks_us():
+    return (_time.monotonic_ns() // 1000) & (_PERIOD - 1)
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & (_PERIOD - 1)
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & (_PERIOD - 1)
+    return diff - _PERIOD if diff >= _PERIOD // 2 else diff
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    _time.sleep(us / 1000000)
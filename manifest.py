@@ -8,7 +8,22 @@ freeze(
     (
         "bleperipheral/__init__.py",
         "bleperipheral/ble_advertising.py",
+        "bleperipheral/ble_advsched.py",
+        "bleperipheral/ble_bootcache.py",
+        "bleperipheral/ble_bulk.py",
+        "bleperipheral/ble_codec.py",
+        "bleperipheral/ble_connection.py",
+        "bleperipheral/ble_connparams.py",
+        "bleperipheral/ble_events.py",
+        "bleperipheral/ble_gatt.py",
+        "bleperipheral/ble_metrics.py",
+        "bleperipheral/ble_notify.py",
         "bleperipheral/ble_peripheral.py",
+        "bleperipheral/ble_publish.py",
+        "bleperipheral/ble_rpc.py",
+        "bleperipheral/ble_scancache.py",
+        "bleperipheral/ble_stream.py",
+        "bleperipheral/ble_uart.py",
         "bleperipheral/util.py",
     ),
     opt=3,